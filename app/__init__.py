@@ -1,8 +1,39 @@
 from flask import Flask
+from app.jobs import jobs
+from logs import column_cache, formats
+from utils import numpy_backend, user_agents
+from utils.cache import log_cache
 
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
+    app.config["LOG_CACHE_MAX_BYTES"] = log_cache.max_bytes
+    app.config["LOG_WORKERS"] = 1  # Processes used to parse a log file
+    app.config["JOB_WORKERS"] = jobs.max_workers  # Concurrent background analyses
+    app.config["JOB_INLINE_WAIT"] = 0.5  # Seconds to wait before showing progress
+    # Log format name or LogFormat/log_format string; None keeps the current
+    # one (auto-detection unless set with --log-format)
+    app.config["LOG_FORMAT"] = None
+    # "python" or "numpy"; None keeps the current backend
+    app.config["ANALYZER_BACKEND"] = None
+    # JSON file of user agent signatures; None keeps the current ones
+    app.config["USER_AGENT_SIGNATURES"] = None
+    # False parses logs every time instead of mapping their column caches;
+    # None keeps the current choice
+    app.config["COLUMN_CACHE"] = None
+    if config:
+        app.config.update(config)
+    log_cache.max_bytes = app.config["LOG_CACHE_MAX_BYTES"]
+    jobs.max_workers = app.config["JOB_WORKERS"]
+    if app.config["LOG_FORMAT"]:
+        formats.configure(app.config["LOG_FORMAT"])
+    if app.config["ANALYZER_BACKEND"]:
+        numpy_backend.configure(app.config["ANALYZER_BACKEND"])
+    if app.config["USER_AGENT_SIGNATURES"]:
+        user_agents.configure(app.config["USER_AGENT_SIGNATURES"])
+    if app.config["COLUMN_CACHE"] is not None:
+        column_cache.configure(app.config["COLUMN_CACHE"])
+
     from .routes import bp
 
     app.register_blueprint(bp)
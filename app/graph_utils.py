@@ -1,18 +1,17 @@
 import plotly.graph_objs as go
-import plotly.io as pio
 
 
-def plot_hourly_requests(data):
+def hourly_figure(data):
     hours = list(data.keys())
     counts = list(data.values())
     fig = go.Figure([go.Bar(x=hours, y=counts)])
     fig.update_layout(
         title="⌛ Hourly Request Volume", xaxis_title="Hour", yaxis_title="Requests"
     )
-    return pio.to_html(fig, full_html=False)
+    return fig
 
 
-def plot_daily_requests(data):
+def daily_figure(data):
     # Sort the data by date
     sorted_items = sorted(data.items())
     days = [day for day, _ in sorted_items]
@@ -29,13 +28,45 @@ def plot_daily_requests(data):
         template="plotly_white",
         height=400,
     )
+    return fig
 
-    return pio.to_html(fig, full_html=False)
 
-
-def plot_status_codes(data):
+def status_figure(data):
     labels = list(data.keys())
     values = list(data.values())
     fig = go.Figure([go.Pie(labels=labels, values=values, hole=0.3)])
     fig.update_layout(title="📶 Status Code Distribution")
-    return pio.to_html(fig, full_html=False)
+    return fig
+
+
+def visitors_figure(data):
+    # Hourly estimates as bars, their daily rollup as a line on its own axis
+    hours = sorted(data["hour"].items())
+    days = sorted(data["day"].items())
+    fig = go.Figure(
+        [
+            go.Bar(
+                x=[hour for hour, _ in hours],
+                y=[count for _, count in hours],
+                name="Per hour",
+            ),
+            go.Scatter(
+                # Plot each day at noon so the line sits over its hours
+                x=[f"{day} 12:00" for day, _ in days],
+                y=[count for _, count in days],
+                name="Per day",
+                mode="lines+markers",
+                yaxis="y2",
+            ),
+        ]
+    )
+    fig.update_layout(
+        title="👥 Unique Visitors (approx.)",
+        xaxis_title="Time",
+        yaxis=dict(title="Distinct IPs per hour"),
+        yaxis2=dict(title="Distinct IPs per day", overlaying="y", side="right"),
+        template="plotly_white",
+        height=400,
+    )
+    return fig
+
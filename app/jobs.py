@@ -0,0 +1,170 @@
+# Background analysis jobs for the dashboard, with progress for polling
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+DEFAULT_WORKERS = 2
+
+# Finished jobs kept around for late status polls
+MAX_FINISHED_JOBS = 100
+
+# Finished jobs whose result is kept, for results too big for the log cache
+MAX_KEPT_RESULTS = 2
+
+
+class Job:
+    """One background analysis, updated by its worker and read by status polls"""
+
+    def __init__(self, key: Hashable, total_bytes: int, description: str = ""):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.description = description
+        self.total_bytes = total_bytes
+        self.state = "queued"
+        self.phase = "Waiting for a worker"
+        self.bytes_done = 0
+        self.rows = 0
+        self.error = None
+        self.result = None
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+        self._start_bytes = None
+
+    def update(self, bytes_done: int, rows: int):
+        """Progress callback: file offset reached and rows parsed so far"""
+        if self._start_bytes is None:
+            # A resumed parse starts past 0, so the rate is measured from
+            # the first offset reported rather than from the file start
+            self._start_bytes = bytes_done
+        self.bytes_done = bytes_done
+        self.rows = rows
+
+    def set_phase(self, phase: str):
+        self.phase = phase
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def eta(self) -> Optional[float]:
+        """Seconds left at the rate seen so far, or None before there is a rate"""
+        if self.started is None or self._start_bytes is None or self.done:
+            return None
+        processed = self.bytes_done - self._start_bytes
+        elapsed = time.monotonic() - self.started
+        if processed <= 0 or elapsed <= 0:
+            return None
+        return max(self.total_bytes - self.bytes_done, 0) * elapsed / processed
+
+    def status(self) -> Dict:
+        end = self.finished or time.monotonic()
+        return {
+            "id": self.id,
+            "description": self.description,
+            "state": self.state,
+            "phase": self.phase,
+            "bytes_done": self.bytes_done,
+            "total_bytes": self.total_bytes,
+            "rows": self.rows,
+            "elapsed": round(end - (self.started or end), 2),
+            "eta": None if self.eta() is None else round(self.eta(), 1),
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs analyses on a thread pool, one job per key at a time.
+
+    Submitting a key that already has a queued or running job returns that
+    job, so concurrent requests for the same work share one run. What the
+    work returns is kept on the job for the most recently finished keys.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        key: Hashable,
+        work: Callable[[Job], None],
+        total_bytes: int = 0,
+        description: str = "",
+    ) -> Job:
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="log-analysis"
+                )
+            job = Job(key, total_bytes, description)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def result(self, key: Hashable):
+        """What the last successful job for a key returned, if still kept"""
+        with self._lock:
+            job = self._results.get(key)
+            return None if job is None else job.result
+
+    def active_count(self) -> int:
+        """Jobs queued or running"""
+        with self._lock:
+            return len(self._active)
+
+    def _run(self, job: Job, work: Callable[[Job], None]):
+        job.state = "running"
+        job.phase = "Starting"
+        job.started = time.monotonic()
+        try:
+            job.result = work(job)
+            job.state = "done"
+            job.phase = "Done"
+        except Exception as e:
+            job.state = "failed"
+            job.phase = "Failed"
+            job.error = str(e)
+        finally:
+            job.finished = time.monotonic()
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+                if job.state == "done":
+                    self._keep_result(job)
+            job._done.set()
+
+    def _keep_result(self, job: Job):
+        self._results.pop(job.key, None)
+        self._results[job.key] = job
+        while len(self._results) > MAX_KEPT_RESULTS:
+            _, oldest = self._results.popitem(last=False)
+            oldest.result = None
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[job_id]
+
+
+jobs = JobManager()
@@ -1,71 +1,55 @@
-from flask import Blueprint, render_template, request, abort
-from utils.analyzer import (
-    group_by_hour,
-    group_by_day,
-    get_status_distribution,
-    classify_user_agents,
-    get_top_ips,
-    get_top_urls,
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    make_response,
+    render_template,
+    request,
+    url_for,
 )
+from utils.analyzer import analyze_rows
+from utils.checkpoint import load_logs_checkpointed
+from app.graph_utils import daily_figure, hourly_figure, status_figure, visitors_figure
+from reports.report_generator import format_header, format_report_sections
+from utils.md_renderer import render_markdown_sections
+from utils.cache import file_identity, log_cache
+from app.jobs import jobs
+from logs.compressed import is_compressed, is_log_file
 from logs.loader import load_logs
-from app.graph_utils import plot_hourly_requests, plot_daily_requests, plot_status_codes
-from reports.report_generator import generate_report
-from utils.md_renderer import render_markdown_report
+from utils.log_index import load_or_build_index
+from utils.metrics import metrics
+from utils import numpy_backend
+import gzip
+import hashlib
 import os
-import tempfile
+import time
 from datetime import datetime, date
 
-bp = Blueprint("dashboard", __name__)
-
-
-def parse_log_timestamp(log_entry):
-    """
-    Parse timestamp from log entry. Handles Apache/Nginx log format.
-    """
-    # For Apache/Nginx logs, the timestamp is usually in the raw log line
-    # Format: [15/Jan/2025:14:30:45 +0200]
+import plotly
+from plotly.offline import get_plotlyjs
 
-    timestamp_field = (
-        log_entry.get("timestamp") or log_entry.get("time") or log_entry.get("date")
-    )
+bp = Blueprint("dashboard", __name__)
 
-    if not timestamp_field:
-        # If no parsed timestamp field, try to extract from raw log line
-        raw_line = log_entry.get("raw_line", "")
-        if raw_line:
-            # Look for timestamp pattern in brackets
-            import re
+LOG_DIR = "logs"
 
-            timestamp_pattern = r"\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2})\s*[+-]\d{4}\]"
-            match = re.search(timestamp_pattern, raw_line)
-            if match:
-                timestamp_field = match.group(1)
+# Chart name -> (figure builder, view key holding its data)
+CHARTS = {
+    "hourly": (hourly_figure, "hourly_data"),
+    "daily": (daily_figure, "daily_data"),
+    "status": (status_figure, "status_data"),
+    "visitors": (visitors_figure, "visitor_data"),
+}
 
-    if not timestamp_field:
-        return None
+# plotly.js is served from the installed package under a versioned URL, so
+# browsers can keep it for a year
+PLOTLY_MAX_AGE = 365 * 24 * 3600
+_plotly_js = None
 
-    # If it's already a datetime object
-    if isinstance(timestamp_field, datetime):
-        return timestamp_field.date()
-
-    # If it's a string, try to parse common formats
-    if isinstance(timestamp_field, str):
-        # Common log timestamp formats
-        formats = [
-            "%d/%b/%Y:%H:%M:%S",  # 15/Jan/2025:14:30:45 (Apache format)
-            "%Y-%m-%d %H:%M:%S",  # 2025-01-15 14:30:45
-            "%Y-%m-%d",  # 2025-01-15
-            "%d/%m/%Y",  # 15/01/2025
-            "%m/%d/%Y",  # 01/15/2025
-        ]
-
-        for fmt in formats:
-            try:
-                return datetime.strptime(timestamp_field, fmt).date()
-            except ValueError:
-                continue
 
-    return None
+def _day_number(day: date) -> int:
+    return (day - date(1970, 1, 1)).days
 
 
 def filter_logs(
@@ -74,167 +58,352 @@ def filter_logs(
     """Filter logs by HTTP method, status code, and date range"""
     if not logs:
         return logs
+    rows = filtered_rows(logs, method_filter, status_filter, start_date, end_date)
+    if rows is None:
+        return logs
+    if numpy_backend.enabled:
+        return numpy_backend.take(logs, rows)
+    return logs.take(rows)
 
-    filtered_logs = logs
 
-    # Filter by HTTP method
-    if method_filter and method_filter != "all":
-        filtered_logs = [
-            log for log in filtered_logs if log.get("method") == method_filter
-        ]
+def filtered_rows(
+    logs, method_filter=None, status_filter=None, start_date=None, end_date=None
+):
+    """Ascending row ids of the table passing the filters, or None if no
+    filter is set and every row does"""
+    wanted = {}
 
-    # Filter by status code
+    # Method and status filters intersect the table's row id indexes
+    if method_filter and method_filter != "all":
+        wanted["method"] = logs.pools["method"].lookup(method_filter)
     if status_filter and status_filter != "all":
-        filtered_logs = [
-            log
-            for log in filtered_logs
-            if (
-                str(log.get("status")) == status_filter
-                or log.get("status") == status_filter
-                or (status_filter.isdigit() and log.get("status") == int(status_filter))
-            )
-        ]
+        wanted["status"] = int(status_filter) if status_filter.isdigit() else None
+    first = _day_number(start_date) if start_date else None
+    last = _day_number(end_date) if end_date else None
+    if None in wanted.values():
+        return []  # A value that never occurs in this file
+    if not wanted and first is None and last is None:
+        return None
 
-    # Filter by date range
-    if start_date or end_date:
-        date_filtered_logs = []
+    if numpy_backend.enabled:
+        # Every filter as one boolean mask over the columns
+        return numpy_backend.matching_rows(logs, wanted, first, last)
 
-        for log in filtered_logs:
-            log_date = parse_log_timestamp(log)
+    rows = logs.rows_matching(**wanted)
+
+    # Filter by date range, on the day written in each log line
+    if start_date or end_date:
+        timestamps, offsets = logs.timestamp, logs.tz_offset
+        date_filtered_rows = []
 
-            if log_date is None:
-                continue  # Skip logs without valid timestamps
+        for i in rows:
+            day = (timestamps[i] + offsets[i] * 60) // 86400
 
             # Check if log date is within range
-            if start_date and log_date < start_date:
+            if first is not None and day < first:
                 continue
-            if end_date and log_date > end_date:
+            if last is not None and day > last:
                 continue
 
-            date_filtered_logs.append(log)
+            date_filtered_rows.append(i)
 
-        filtered_logs = date_filtered_logs
+        rows = date_filtered_rows
 
-    return filtered_logs
+    return rows
 
 
-def get_available_methods(logs):
-    """Get all unique HTTP methods from logs"""
-    if not logs:
-        return []
-    methods = set(log.get("method") for log in logs if log.get("method"))
-    return sorted(list(methods))
+def format_date_range_info(actual_start, actual_end, start_date, end_date):
+    info_parts = []
 
+    if start_date or end_date:
+        filter_start = start_date or actual_start
+        filter_end = end_date or actual_end
+        info_parts.append(f"Filtered: {filter_start} to {filter_end}")
 
-def get_available_status_codes(logs):
-    """Get all unique status codes from logs"""
-    if not logs:
-        return []
-    status_codes = set(log.get("status") for log in logs if log.get("status"))
-    return sorted(list(status_codes))
+    info_parts.append(f"Available data: {actual_start} to {actual_end}")
 
+    return " | ".join(info_parts)
 
-def get_date_range_info(logs, start_date, end_date):
-    """Get information about the date range of logs"""
-    if not logs:
+
+def generate_markdown_report(sections, log_filename):
+    """Render the Markdown report of already computed sections as HTML"""
+    try:
+        # Build the report in memory, one Markdown section at a time
+        log_name = os.path.basename(log_filename) if log_filename else None
+        parts = [format_header(log_name)]
+        parts += format_report_sections(**sections)
+
+        return render_markdown_sections(parts)
+
+    except Exception as e:
+        print(f"Error generating markdown report: {e}")
         return None
 
-    # Get actual date range of logs
-    log_dates = []
-    for log in logs:
-        log_date = parse_log_timestamp(log)
-        if log_date:
-            log_dates.append(log_date)
 
-    if not log_dates:
-        return "No valid timestamps found in logs"
+def load_current_logs(log_path, identity, workers=1, progress=None):
+    """Parse a log file, only reading what was appended if an older version is cached"""
+    if is_compressed(log_path):
+        # Rotated archives don't grow; decompress and parse the whole file
+        return load_logs(log_path, workers, progress)
 
-    actual_start = min(log_dates)
-    actual_end = max(log_dates)
+    table, checkpoint = load_logs_checkpointed(
+        log_path,
+        log_cache.latest(log_path, "logs"),
+        log_cache.latest(log_path, "checkpoint"),
+        workers=workers,
+        progress=progress,
+    )
+    log_cache.put((identity, "checkpoint"), checkpoint)
+    return table
 
-    info_parts = []
 
-    if start_date or end_date:
-        filter_start = start_date or actual_start
-        filter_end = end_date or actual_end
-        info_parts.append(f"Filtered: {filter_start} to {filter_end}")
+def build_dashboard_view(index, logs, filters):
+    """Compute everything the dashboard shows for one filter combination.
 
-    info_parts.append(f"Available data: {actual_start} to {actual_end}")
+    Counts, time buckets and visitors come from the index; top lists are
+    counted exactly over the ids of the table rows that pass the filters.
+    """
+    method_filter, status_filter, start_date, end_date = filters
+    result = index.query(method_filter, status_filter, start_date, end_date)
+    sections = result["sections"]
+
+    view = {
+        "filtered_count": result["count"],
+        "date_range_info": None,
+        "hourly_data": None,
+        "daily_data": None,
+        "status_data": None,
+        "visitor_data": None,
+        # Inputs of the Markdown report, rendered on demand by report_html()
+        "sections": sections,
+    }
+
+    if result["count"]:
+        view["date_range_info"] = format_date_range_info(
+            result["first_day"], result["last_day"], start_date, end_date
+        )
 
-    return " | ".join(info_parts)
+        # Analytics on filtered data, shared by the charts and the report
+        view["hourly_data"] = sections["hour_counts"]
+        view["daily_data"] = sections["day_counts"]
+        view["status_data"] = sections["status_distribution"]
+        view["visitor_data"] = sections["unique_visitors"]
 
+        rows = filtered_rows(logs, method_filter, status_filter, start_date, end_date)
+        sections.update(analyze_rows(logs, rows))
 
-def generate_markdown_report(logs, log_filename):
-    """Generate markdown report from logs and return rendered HTML"""
-    if not logs:
+    return view
+
+
+def report_html(identity, filters, view, log_filename):
+    """Rendered report for one file and filter combination, cached as HTML"""
+    if not view["filtered_count"]:
         return None
+    return log_cache.get_or_compute(
+        (identity, "report", filters),
+        lambda: generate_markdown_report(view["sections"], log_filename),
+    )
 
-    try:
-        # Get all the analytics data
-        top_ips = get_top_ips(logs)
-        top_urls = get_top_urls(logs)
-        status_distribution = get_status_distribution(logs)
-        hour_counts = group_by_hour(logs)
-        day_counts = group_by_day(logs)
-        user_agent_classes = classify_user_agents(logs)
-
-        # Create a temporary file to store the markdown report
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".md", delete=False
-        ) as temp_file:
-            temp_filename = temp_file.name
-
-            # Generate the report content without saving to the reports directory
-            from reports.report_generator import (
-                format_section,
-                format_status_section,
-                format_time_series,
-                format_user_agents,
-            )
 
-            now = datetime.now()
-            timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
-
-            # Create header with log filename
-            log_info = f" - {os.path.basename(log_filename)}" if log_filename else ""
-            header = f"# Log Analyzer Report{log_info}\nGenerated on: `{timestamp}`\n\n"
-
-            body = "\n\n".join(
-                [
-                    format_section("Top IPs", top_ips),
-                    format_section("Top URLs", top_urls),
-                    format_status_section(status_distribution),
-                    format_time_series("Hourly Request Volume", hour_counts),
-                    format_time_series("Daily Request Volume", day_counts),
-                    format_user_agents("Top Bots", user_agent_classes.get("bots", {})),
-                    format_user_agents(
-                        "Top Browsers", user_agent_classes.get("browsers", {})
-                    ),
-                    format_user_agents(
-                        "Unknown Agents", user_agent_classes.get("unknown", {})
-                    ),
-                ]
-            )
+def list_log_files(log_dir):
+    """Log files in a directory, including rotated and compressed ones"""
+    return sorted(f for f in os.listdir(log_dir) if is_log_file(f))
 
-            report_content = header + body
-            temp_file.write(report_content)
 
-        # Render the markdown to HTML
-        html_content = render_markdown_report(temp_filename)
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None  # Invalid date format, ignore
+
+
+def request_filters():
+    """(method, status, start date, end date) from the query string"""
+    return (
+        request.args.get("method", "all"),
+        request.args.get("status", "all"),
+        _parse_date(request.args.get("start_date")),
+        _parse_date(request.args.get("end_date")),
+    )
 
-        # Clean up the temporary file
-        os.unlink(temp_filename)
 
-        return html_content
+def load_analysis(log_path, identity, workers=1, job=None):
+    """(parsed table, pre-aggregated index) of a log file. The file is only
+    parsed if no cached table matches it, and the sidecar index is built,
+    or extended with appended rows, only if stale; `job` receives progress
+    when run in the background"""
+
+    def get_logs():
+        table = log_cache.get((identity, "logs"))
+        if table is None:
+            if job:
+                job.set_phase("Parsing")
+            table = log_cache.put(
+                (identity, "logs"),
+                load_current_logs(log_path, identity, workers, job.update if job else None),
+            )
+        return table
+
+    def get_logs_and_checkpoint():
+        table = get_logs()
+        if job:
+            job.set_phase("Building index")
+        return table, log_cache.get((identity, "checkpoint"))
+
+    if job:
+        job.set_phase("Loading index")
+    index = log_cache.get_or_compute(
+        (identity, "index"),
+        lambda: load_or_build_index(
+            log_path, identity, get_logs_and_checkpoint, log_cache.latest(log_path, "index")
+        ),
+    )
+    return get_logs(), index
+
+
+def analyzed(identity):
+    """(table, index) of a file from the cache, or from the job that loaded
+    them if the cache couldn't keep them, or None if not analyzed yet"""
+    if (identity, "logs") in log_cache and (identity, "index") in log_cache:
+        logs, index = log_cache.get((identity, "logs")), log_cache.get((identity, "index"))
+        if logs is not None and index is not None:
+            return logs, index
+    return jobs.result((identity, "index"))
+
+
+def submit_analysis_job(log_path, identity):
+    """Load a file's table and index in the background; identical requests share one job"""
+    workers = current_app.config["LOG_WORKERS"]
+    return jobs.submit(
+        (identity, "index"),
+        lambda job: load_analysis(log_path, identity, workers, job),
+        total_bytes=identity.size,
+        description=os.path.basename(log_path),
+    )
 
-    except Exception as e:
-        print(f"Error generating markdown report: {e}")
-        return None
+
+def load_dashboard_view(log_path, identity, filters):
+    """(index, view) for a log file and filter combination, reusing the cache"""
+    analysis = analyzed(identity)
+    if analysis is None:
+        analysis = load_analysis(log_path, identity, current_app.config["LOG_WORKERS"])
+    logs, index = analysis
+    view = log_cache.get_or_compute(
+        (identity, "view", filters),
+        lambda: build_dashboard_view(index, logs, filters),
+    )
+    return index, view
+
+
+def cached_response(body, gzipped, etag, mimetype, max_age=0):
+    """Response honouring If-None-Match and Accept-Encoding: gzip"""
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    elif request.accept_encodings["gzip"]:
+        response = make_response(gzipped)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if max_age == 0:
+        response.cache_control.no_cache = True  # Always revalidate by ETag
+    return response
+
+
+@bp.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@bp.after_app_request
+def record_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.observe_request(
+            request.endpoint or "unmatched",
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+        )
+    return response
+
+
+@bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Stage counters, cache and job gauges and request latencies for Prometheus"""
+    cache = log_cache.stats()
+    extra = {
+        "cache_entries": ("gauge", "Entries in the log cache", cache["entries"]),
+        "cache_bytes": ("gauge", "Estimated bytes held by the log cache", cache["bytes"]),
+        "cache_hits_total": ("counter", "Log cache hits", cache["hits"]),
+        "cache_misses_total": ("counter", "Log cache misses", cache["misses"]),
+        "cache_evictions_total": ("counter", "Log cache evictions", cache["evictions"]),
+        "jobs_active": ("gauge", "Background analyses queued or running", jobs.active_count()),
+    }
+    response = make_response(metrics.prometheus(extra))
+    response.mimetype = "text/plain"
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+@bp.route("/plotly.min.js", methods=["GET"])
+def plotly_js():
+    global _plotly_js
+    if _plotly_js is None:
+        body = get_plotlyjs().encode("utf-8")
+        _plotly_js = (body, gzip.compress(body), f"plotly-{plotly.__version__}")
+    body, gzipped, etag = _plotly_js
+    return cached_response(body, gzipped, etag, "application/javascript", PLOTLY_MAX_AGE)
+
+
+@bp.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Progress of a background analysis, polled by the dashboard"""
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.status())
+
+
+@bp.route("/api/charts/<chart>", methods=["GET"])
+def chart_data(chart):
+    """Plotly figure JSON for one dashboard chart, with the dashboard's filters"""
+    if chart not in CHARTS or not os.path.exists(LOG_DIR):
+        abort(404)
+    selected_file = request.args.get("log")
+    if selected_file not in list_log_files(LOG_DIR):
+        abort(404)
+
+    log_path = os.path.join(LOG_DIR, selected_file)
+    identity = file_identity(log_path)
+    filters = request_filters()
+
+    # The figure only changes with the file's identity and the filters
+    etag = hashlib.sha1(repr((tuple(identity), chart, filters)).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        return cached_response(b"", b"", etag, "application/json")
+
+    def build():
+        _, view = load_dashboard_view(log_path, identity, filters)
+        figure, key = CHARTS[chart]
+        with metrics.stage(f"chart.{chart}") as stage:
+            body = (figure(view[key]).to_json() if view["filtered_count"] else "{}").encode("utf-8")
+            stage.bytes = len(body)
+        return body, gzip.compress(body)
+
+    body, gzipped = log_cache.get_or_compute((identity, "chart", chart, filters), build)
+    return cached_response(body, gzipped, etag, "application/json")
 
 
 @bp.route("/", methods=["GET"])
 def dashboard():
-    log_dir = "logs"
+    log_dir = LOG_DIR
 
     # Check if log directory exists
     if not os.path.exists(log_dir):
@@ -245,8 +414,8 @@ def dashboard():
             error="Log directory not found",
         )
 
-    # Get all log files
-    log_files = [f for f in os.listdir(log_dir) if f.endswith(".log")]
+    # Get all log files, including rotated and compressed ones
+    log_files = list_log_files(log_dir)
 
     # Handle case where no log files exist
     if not log_files:
@@ -265,65 +434,62 @@ def dashboard():
         selected_file = log_files[0]
 
     # Get filter parameters
-    method_filter = request.args.get("method", "all")
-    status_filter = request.args.get("status", "all")
-
-    # Parse date parameters
+    filters = request_filters()
+    method_filter, status_filter, start_date, end_date = filters
     start_date_str = request.args.get("start_date")
     end_date_str = request.args.get("end_date")
 
-    start_date = None
-    end_date = None
-
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
-        except ValueError:
-            pass  # Invalid date format, ignore
-
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
-        except ValueError:
-            pass  # Invalid date format, ignore
-
-    # Load and process logs
+    # Load and process logs, reusing anything computed for this exact file
     try:
-        logs = load_logs(os.path.join(log_dir, selected_file))
+        log_path = os.path.join(log_dir, selected_file)
+        identity = file_identity(log_path)
+
+        # Files not analyzed yet are handled by a background job; the page
+        # shows its progress unless it finishes almost straight away
+        if analyzed(identity) is None:
+            job = submit_analysis_job(log_path, identity)
+            if not job.wait(current_app.config["JOB_INLINE_WAIT"]):
+                return render_template(
+                    "dashboard.html",
+                    log_files=log_files,
+                    selected_file=selected_file,
+                    selected_method=method_filter,
+                    selected_status=status_filter,
+                    start_date=start_date_str,
+                    end_date=end_date_str,
+                    job=job.status(),
+                    job_url=url_for("dashboard.job_status", job_id=job.id),
+                )
+            if job.error:
+                raise RuntimeError(job.error)
+
+        index, view = load_dashboard_view(log_path, identity, filters)
 
         # Get available filter options from all logs
-        available_methods = get_available_methods(logs)
-        available_status_codes = get_available_status_codes(logs)
-
-        # Apply filters
-        filtered_logs = filter_logs(
-            logs, method_filter, status_filter, start_date, end_date
-        )
-
-        # Get date range information
-        date_range_info = get_date_range_info(filtered_logs, start_date, end_date)
-
-        # Initialize charts as None
-        hourly_chart = daily_chart = status_chart = None
-        report_html = None
-
-        # Only generate charts if we have log data
-        if filtered_logs:
-            # Analytics on filtered data
-            hourly_data = group_by_hour(filtered_logs)
-            daily_data = group_by_day(filtered_logs)
-            status_data = get_status_distribution(filtered_logs)
-
-            hourly_chart = plot_hourly_requests(hourly_data)
-            daily_chart = plot_daily_requests(daily_data)
-            status_chart = plot_status_codes(status_data)
-
-            # Generate markdown report
-            report_html = generate_markdown_report(filtered_logs, selected_file)
+        available_methods = index.methods()
+        available_status_codes = index.status_codes()
+        total_logs = index.total
+
+        # Charts are fetched as JSON by the page, only if there is data
+        chart_urls = None
+        if view["filtered_count"]:
+            chart_filters = {
+                key: value
+                for key, value in request.args.items()
+                if key in ("method", "status", "start_date", "end_date")
+            }
+            chart_urls = {
+                chart: url_for(
+                    "dashboard.chart_data", chart=chart, log=selected_file, **chart_filters
+                )
+                for chart in CHARTS
+            }
+
+        date_range_info = view["date_range_info"]
+        report = report_html(identity, filters, view, selected_file)
 
         # Calculate filter stats
-        total_logs = len(logs) if logs else 0
-        filtered_count = len(filtered_logs) if filtered_logs else 0
+        filtered_count = view["filtered_count"]
 
     except Exception as e:
         return render_template(
@@ -337,9 +503,8 @@ def dashboard():
         "dashboard.html",
         log_files=log_files,
         selected_file=selected_file,
-        hourly_chart=hourly_chart,
-        daily_chart=daily_chart,
-        status_chart=status_chart,
+        chart_urls=chart_urls,
+        plotly_url=url_for("dashboard.plotly_js", v=plotly.__version__),
         # Filter options
         available_methods=available_methods,
         available_status_codes=available_status_codes,
@@ -352,6 +517,7 @@ def dashboard():
         # Stats
         total_logs=total_logs,
         filtered_count=filtered_count,
+        cache_stats=log_cache.stats(),
         # Markdown report
-        report_html=report_html,
+        report_html=report,
     )
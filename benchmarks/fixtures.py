@@ -0,0 +1,38 @@
+# Seeded sample log files for the benchmarks, generated once and cached
+import contextlib
+import io
+import os
+
+from sample_data.generate_sample_logs import LogGenerator
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+DEFAULT_SEED = 42
+
+# Bumped whenever LogGenerator's output for a given seed changes, so stale
+# fixtures are not benchmarked against a baseline taken on new ones
+FIXTURE_VERSION = 2
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fixtures")
+
+
+def fixture_path(size: str, seed: int = DEFAULT_SEED) -> str:
+    return os.path.join(FIXTURES_DIR, f"access_{size}_s{seed}_v{FIXTURE_VERSION}.log")
+
+
+def ensure_fixture(size: str, seed: int = DEFAULT_SEED) -> str:
+    """Path of the fixture for a size name, generating it on first use"""
+    path = fixture_path(size, seed)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    print(f"Generating {SIZES[size]:,}-line fixture (seed {seed})...")
+    temp_path = f"{path}.tmp"
+    # The generator's own progress output is not useful here
+    with contextlib.redirect_stdout(io.StringIO()):
+        LogGenerator(seed).generate_logs(
+            SIZES[size], output_path=temp_path, workers=os.cpu_count() or 1
+        )
+    os.replace(temp_path, path)
+    return path
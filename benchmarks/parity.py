@@ -0,0 +1,128 @@
+# Parity check: the NumPy backend must give exactly the pure-Python results
+#
+#   python -m benchmarks.parity --sizes 10k,1m
+import argparse
+import json
+import sys
+import time
+from datetime import date
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.fixtures import DEFAULT_SEED, SIZES, ensure_fixture
+
+# Analyzer functions compared, with their keyword arguments
+FUNCTIONS = [
+    ("get_top_ips", {}),
+    ("get_top_urls", {"top_n": 20}),
+    ("get_top_ips", {"capacity": 100}),
+    ("get_status_distribution", {}),
+    ("group_by_hour", {}),
+    ("group_by_day", {}),
+    ("classify_user_agents", {}),
+    ("count_unique_visitors", {}),
+    ("count_unique_visitors", {"fields": ("ip", "user_agent")}),
+    ("analyze_logs", {}),
+]
+
+# Dashboard filters compared: (method, status, start date, end date)
+FILTERS = [
+    ("POST", None, None, None),
+    (None, "404", None, None),
+    ("GET", "200", None, None),
+    (None, None, date(2020, 9, 5), date(2020, 9, 10)),
+    ("POST", "404", date(2020, 9, 3), None),
+    ("PURGE", None, None, None),
+]
+
+
+def timed(fn: Callable) -> Tuple[float, object]:
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def canonical(result) -> str:
+    """Results as JSON with dict order kept, so order differences count"""
+    return json.dumps(result, default=list)
+
+
+def table_rows(table) -> Tuple[List[Dict], Dict]:
+    postings = {
+        name: sorted((value, list(rows)) for value, rows in postings.items())
+        for name, postings in table.postings.items()
+    }
+    return list(table), postings
+
+
+def run_backend(backend: str, table) -> Dict[str, Tuple[float, str]]:
+    from app.routes import filter_logs
+    from utils import analyzer, numpy_backend
+
+    numpy_backend.configure(backend)
+    results = {}
+    for name, kwargs in FUNCTIONS:
+        key = f"{name}({', '.join(f'{k}={v}' for k, v in kwargs.items())})"
+        seconds, result = timed(lambda: getattr(analyzer, name)(table, **kwargs))
+        results[key] = seconds, canonical(result)
+
+    for method, status, start, end in FILTERS:
+        key = f"filter_logs(method={method}, status={status}, from={start}, to={end})"
+        seconds, subset = timed(lambda: filter_logs(table, method, status, start, end))
+        results[key] = seconds, canonical(table_rows(subset))
+        # Codes in a filtered table are not in first-occurrence order
+        _, sections = timed(lambda: analyzer.analyze_logs(subset))
+        results[f"analyze_logs of {key}"] = 0.0, canonical(sections)
+    return results
+
+
+def check_size(size: str, seed: int) -> bool:
+    from logs.loader import load_logs
+
+    table = load_logs(ensure_fixture(size, seed))
+    python = run_backend("python", table)
+    numpy = run_backend("numpy", table)
+
+    print(f"\n{size} ({len(table):,} rows)")
+    ok = True
+    for key, (python_seconds, expected) in python.items():
+        numpy_seconds, actual = numpy[key]
+        if actual != expected:
+            ok = False
+            print(f"  ❌ {key}: results differ")
+        elif python_seconds:
+            speedup = python_seconds / max(numpy_seconds, 1e-9)
+            print(
+                f"  ✅ {key:<72} {python_seconds * 1000:>9.2f} ms -> "
+                f"{numpy_seconds * 1000:>8.2f} ms ({speedup:.1f}x)"
+            )
+    return ok
+
+
+def main(argv: List[str] = None) -> int:
+    from utils import numpy_backend
+
+    parser = argparse.ArgumentParser(description="Compare the NumPy and Python backends")
+    parser.add_argument(
+        "--sizes",
+        default="10k",
+        help=f"Comma-separated fixture sizes from {', '.join(SIZES)} (default: 10k)",
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Fixture seed")
+    args = parser.parse_args(argv)
+
+    if not numpy_backend.available():
+        print("❌ NumPy is not installed")
+        return 2
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        print(f"❌ Unknown size: {', '.join(unknown)}")
+        return 2
+
+    ok = all([check_size(size, args.seed) for size in sizes])
+    print("\n✅ Backends agree" if ok else "\n❌ Backends disagree")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+# Benchmark suite: parse, log format, analysis, report and dashboard timings with peak RSS
+#
+#   python -m benchmarks.run --sizes 10k,1m
+#   python -m benchmarks.run --sizes 10k --save-baseline
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.fixtures import DEFAULT_SEED, SIZES, ensure_fixture
+from utils.metrics import peak_rss_bytes
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BENCHMARKS_DIR, "results.json")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+# A metric regresses when it is this fraction worse than the baseline...
+DEFAULT_THRESHOLD = 0.25
+
+# ...and worse by more than this much, so millisecond timings on the small
+# fixture don't fail on scheduler noise
+NOISE_FLOOR_SECONDS = 0.01
+NOISE_FLOOR_RSS_MB = 16
+
+# Dashboard query strings timed after the first page load
+FILTERED_QUERY = "&method=POST&status=404"
+
+
+def best_of(repeat: int, fn: Callable) -> Tuple[float, object]:
+    """(fastest wall time in seconds, last result) of calling fn() `repeat` times"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process's resident memory, in MB"""
+    return peak_rss_bytes() / (1024 * 1024)
+
+
+def bench_parse(path: str, repeat: int) -> Dict[str, Dict]:
+    from logs.loader import iter_logs, load_logs
+
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    seconds, table = best_of(repeat, lambda: load_logs(path))
+    metrics = {
+        "parse.load_logs": {
+            "seconds": seconds,
+            "rows_per_sec": len(table) / seconds,
+            "mb_per_sec": size_mb / seconds,
+        }
+    }
+    del table
+
+    # Reopening the file once its parsed columns are saved next to it
+    from logs import column_cache
+
+    column_cache.configure(True)
+    try:
+        load_logs(path)
+        seconds, table = best_of(repeat, lambda: load_logs(path))
+    finally:
+        column_cache.configure(False)
+    metrics["parse.column_cache"] = {
+        "seconds": seconds,
+        "rows_per_sec": len(table) / seconds,
+        "mb_per_sec": size_mb / seconds,
+    }
+    del table
+
+    seconds, rows = best_of(repeat, lambda: sum(1 for _ in iter_logs(path)))
+    metrics["parse.iter_logs"] = {
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds,
+        "mb_per_sec": size_mb / seconds,
+    }
+    return metrics
+
+
+def _format_variants(data: bytes) -> Dict[str, Callable[[], bytes]]:
+    """The combined-format fixture rewritten in each built-in format, built
+    on demand so only one copy is held at a time"""
+    lines = data.splitlines()
+
+    def rewrite(transform) -> Callable[[], bytes]:
+        return lambda: b"\n".join([transform(line) for line in lines]) + b"\n"
+
+    def ipv6(line: bytes) -> bytes:
+        ip, _, rest = line.partition(b" ")
+        return b"2001:db8::" + ip.replace(b".", b":") + b" " + rest
+
+    return {
+        "combined": lambda: data,
+        "combined_ipv6": rewrite(ipv6),
+        # Without the quoted referrer and user agent
+        "common": rewrite(lambda line: line.rsplit(b' "', 2)[0]),
+        "nginx_main": rewrite(lambda line: line + b' "-"'),
+        "nginx_timed": rewrite(lambda line: line + b" 0.004"),
+    }
+
+
+def bench_formats(path: str, repeat: int) -> Dict[str, Dict]:
+    """Parse throughput of each built-in log format, with the split parser
+    and with the regex alone"""
+    from logs import formats
+    from logs.loader import parse_buffer
+
+    with open(path, "rb") as f:
+        variants = _format_variants(f.read())
+    metrics = {}
+    for variant, build in variants.items():
+        data = build()
+        size_mb = len(data) / (1024 * 1024)
+        spec = formats.NAMED_FORMATS[variant.replace("_ipv6", "")]
+        regex_only = formats.LogFormat(spec)
+        regex_only.split = formats._no_split_parser
+        for mode, log_format in (("split", formats.get_format(spec)), ("regex", regex_only)):
+            seconds, table = best_of(
+                repeat, lambda: parse_buffer(data, log_format=log_format)
+            )
+            if table.rejected:
+                raise RuntimeError(f"{table.rejected:,} {variant} lines were rejected")
+            metrics[f"formats.{variant}.{mode}"] = {
+                "seconds": seconds,
+                "rows_per_sec": len(table) / seconds,
+                "mb_per_sec": size_mb / seconds,
+            }
+            del table
+        del data
+    return metrics
+
+
+def bench_analyzers(path: str, repeat: int) -> Dict[str, Dict]:
+    from logs.loader import load_logs
+    from utils import analyzer, numpy_backend
+
+    table = load_logs(path)
+    functions = [
+        "get_top_ips",
+        "get_top_urls",
+        "get_status_distribution",
+        "group_by_hour",
+        "group_by_day",
+        "classify_user_agents",
+        "count_unique_visitors",
+        "analyze_logs",
+    ]
+    # The NumPy backend's timings are reported as "analyzer.numpy.*"
+    backends = {"python": "analyzer"}
+    if numpy_backend.available():
+        backends["numpy"] = "analyzer.numpy"
+    metrics = {}
+    for backend, prefix in backends.items():
+        numpy_backend.configure(backend)
+        for name in functions:
+            function = getattr(analyzer, name)
+            seconds, _ = best_of(repeat, lambda: function(table))
+            metrics[f"{prefix}.{name}"] = {"seconds": seconds, "rows_per_sec": len(table) / seconds}
+    numpy_backend.configure("python")
+    return metrics
+
+
+def bench_report(path: str, repeat: int) -> Dict[str, Dict]:
+    from logs.loader import load_logs
+    from reports.report_generator import format_header, format_report_sections
+    from utils import md_renderer
+    from utils.analyzer import analyze_logs
+
+    sections = analyze_logs(load_logs(path))
+
+    def markdown():
+        return [format_header(os.path.basename(path))] + format_report_sections(**sections)
+
+    def html():
+        # Time a cold render, not a hit in the per-section HTML cache
+        md_renderer._section_cache.clear()
+        return md_renderer.render_markdown_sections(parts)
+
+    seconds, parts = best_of(repeat, markdown)
+    metrics = {"report.markdown": {"seconds": seconds}}
+    seconds, _ = best_of(repeat, html)
+    metrics["report.html"] = {"seconds": seconds}
+    return metrics
+
+
+def bench_dashboard(path: str, repeat: int) -> Dict[str, Dict]:
+    """Request latency through the Flask test client, from a cold cache"""
+    site = tempfile.mkdtemp(prefix="log-bench-")
+    try:
+        os.makedirs(os.path.join(site, "logs"))
+        name = os.path.basename(path)
+        log_path = os.path.join(site, "logs", name)
+        os.symlink(path, log_path)
+        # LOG_DIR is relative to the working directory
+        os.chdir(site)
+
+        from app import create_app
+        from utils import md_renderer
+        from utils.cache import log_cache, sidecar_path
+        from utils.log_index import INDEX_SUFFIX
+
+        # Wait for the analysis instead of returning the progress page
+        client = create_app({"JOB_INLINE_WAIT": 24 * 3600}).test_client()
+        page = f"/?log={name}"
+        requests = {
+            "dashboard.cold": page,
+            "dashboard.warm": page,
+            "dashboard.filtered": page + FILTERED_QUERY,
+            "dashboard.chart": f"/api/charts/hourly?log={name}",
+        }
+
+        timings = {key: [] for key in requests}
+        for _ in range(repeat):
+            log_cache.clear()
+            md_renderer._section_cache.clear()
+            index_path = sidecar_path(log_path, INDEX_SUFFIX)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            for key, url in requests.items():
+                start = time.perf_counter()
+                response = client.get(url)
+                timings[key].append(time.perf_counter() - start)
+                if response.status_code != 200 or b'class="error"' in response.data:
+                    raise RuntimeError(f"{url} failed with status {response.status_code}")
+        return {key: {"seconds": min(values)} for key, values in timings.items()}
+    finally:
+        os.chdir(BENCHMARKS_DIR)
+        shutil.rmtree(site, ignore_errors=True)
+
+
+GROUPS = {
+    "parse": bench_parse,
+    "formats": bench_formats,
+    "analyzers": bench_analyzers,
+    "report": bench_report,
+    "dashboard": bench_dashboard,
+}
+
+
+def run_group(group: str, path: str, repeat: int) -> Tuple[Dict[str, Dict], float]:
+    """Worker: one group's metrics and the process's peak RSS"""
+    from logs import column_cache
+
+    # Every group parses the fixture; only bench_parse times the column cache
+    column_cache.configure(False)
+    return GROUPS[group](path, repeat), peak_rss_mb()
+
+
+def run_size(size: str, seed: int, repeat: int, groups: List[str]) -> Dict[str, Dict]:
+    """Every metric for one fixture size.
+
+    Each group runs in a fresh process so its peak RSS is its own and not
+    the high-water mark of whatever ran before it.
+    """
+    path = ensure_fixture(size, seed)
+    metrics = {}
+    context = multiprocessing.get_context("spawn")
+    for group in groups:
+        print(f"  {size} {group}...", flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            group_metrics, rss = pool.submit(run_group, group, path, repeat).result()
+        for metric in group_metrics.values():
+            metric["peak_rss_mb"] = rss
+        metrics.update(group_metrics)
+    return metrics
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Descriptions of every metric worse than the baseline by more than
+    `threshold` (a fraction) and the noise floor"""
+    regressions = []
+    for size, metrics in results["results"].items():
+        for name, metric in metrics.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if not base:
+                continue
+            for key, floor in (("seconds", NOISE_FLOOR_SECONDS), ("peak_rss_mb", NOISE_FLOOR_RSS_MB)):
+                if key not in metric or not base.get(key):
+                    continue
+                now, before = metric[key], base[key]
+                if now > before * (1 + threshold) and now - before > floor:
+                    regressions.append(
+                        f"{size} {name} {key}: {before:.4g} -> {now:.4g} "
+                        f"(+{(now / before - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def print_results(results: Dict):
+    for size, metrics in results["results"].items():
+        print(f"\n{size} ({SIZES[size]:,} lines)")
+        for name, metric in metrics.items():
+            throughput = ""
+            if "rows_per_sec" in metric:
+                throughput = f"{metric['rows_per_sec']:>14,.0f} rows/s"
+            print(
+                f"  {name:<34} {metric['seconds'] * 1000:>11.2f} ms"
+                f"{throughput}  {metric['peak_rss_mb']:>8.1f} MB peak"
+            )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Log analyzer benchmarks")
+    parser.add_argument(
+        "--sizes",
+        default="10k,1m",
+        help=f"Comma-separated fixture sizes from {', '.join(SIZES)} (default: 10k,1m)",
+    )
+    parser.add_argument(
+        "--groups",
+        default=",".join(GROUPS),
+        help=f"Comma-separated benchmark groups from {', '.join(GROUPS)}",
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Fixture seed")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per measurement; the fastest is kept"
+    )
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed slowdown or memory growth as a fraction (default: 0.25)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the new baseline instead of comparing",
+    )
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    groups = [group.strip() for group in args.groups.split(",") if group.strip()]
+    unknown = [s for s in sizes if s not in SIZES] + [g for g in groups if g not in GROUPS]
+    if unknown:
+        print(f"❌ Unknown size or group: {', '.join(unknown)}")
+        return 2
+
+    results = {
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+    for size in sizes:
+        results["results"][size] = run_size(size, args.seed, args.repeat, groups)
+
+    print_results(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results saved to `{args.output}`")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"✅ Baseline saved to `{args.baseline}`")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("ℹ️ No baseline to compare with; run with --save-baseline to store one.")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("meta", {}).get("seed") != args.seed:
+        print("⚠️ Baseline was taken on fixtures with a different seed.")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n✅ No regressions beyond {args.threshold:.0%} against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
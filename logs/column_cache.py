@@ -0,0 +1,194 @@
+# Memory-mapped binary cache of parsed log columns, for reopening a log without parsing it
+import json
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from logs import formats
+from logs.table import COLUMNS, INDEXED_COLUMNS, LogTable, Postings, StringPool
+from utils.cache import FileIdentity, sidecar_path
+from utils.metrics import metrics
+
+COLUMN_CACHE_VERSION = 1
+COLUMN_CACHE_SUFFIX = "columns.bin"
+
+MAGIC = b"LOGCOLUMNS\n"
+
+# Sections start on multiples of this many bytes, so every column can be
+# cast to its typecode in place
+ALIGNMENT = 8
+
+# Bytes per value of each column on this platform
+ITEMSIZES = {name: array(typecode).itemsize for name, typecode in COLUMNS.items()}
+ROW_ITEMSIZE = array("I").itemsize  # Row ids in posting lists
+
+
+def configure(enable: bool = True):
+    """Read and write column caches (the default) or not, from now on.
+
+    The choice is also put in the environment, so worker processes started
+    afterwards do the same.
+    """
+    global enabled
+    enabled = enable
+    os.environ["LOG_COLUMN_CACHE"] = "1" if enable else "0"
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _format_spec() -> Optional[str]:
+    """The forced log format; None means each file's own detected one"""
+    return formats.configured.spec if formats.configured else None
+
+
+def _expected(identity: FileIdentity, end: int) -> Dict:
+    """Header fields that must match for a saved cache to be used"""
+    return {
+        "version": COLUMN_CACHE_VERSION,
+        "identity": [identity.inode, identity.size, identity.mtime],
+        "end": end,
+        "format": _format_spec(),
+        "byteorder": sys.byteorder,
+        "itemsizes": dict(ITEMSIZES, rows=ROW_ITEMSIZE),
+    }
+
+
+def load_columns(filepath: str, identity: FileIdentity, end: int = None) -> Optional[LogTable]:
+    """The table parsed from the first `end` bytes (default: all) of a log
+    file, mapped from its column cache, or None if there is no cache or it
+    was written for another version of the file"""
+    if not enabled:
+        return None
+    path = sidecar_path(filepath, COLUMN_CACHE_SUFFIX)
+    with metrics.stage("columns.load") as stage:
+        try:
+            with open(path, "rb") as f:
+                if f.readline() != MAGIC:
+                    return None
+                header = json.loads(f.readline())
+                expected = _expected(identity, identity.size if end is None else end)
+                if any(header.get(key) != value for key, value in expected.items()):
+                    return None
+                start = _aligned(f.tell())
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            table = _map_table(memoryview(buffer)[start:], header)
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+        stage.lines = len(table)
+        stage.bytes = len(buffer)
+    return table
+
+
+def _map_table(data: memoryview, header: Dict) -> LogTable:
+    """A LogTable over the sections of a mapped cache, copying only the pools"""
+    if len(data) < header["length"]:
+        raise ValueError("Truncated column cache")
+
+    def section(offset: int, length: int, typecode: str = "B") -> memoryview:
+        return data[offset : offset + length].cast(typecode)
+
+    pools = {}
+    for name, (count, offset, length) in header["pools"].items():
+        values = bytes(section(offset, length)).split(b"\n") if count else []
+        if len(values) != count:
+            raise ValueError(f"Corrupt {name} pool in column cache")
+        pools[name] = StringPool.from_values(values)
+
+    table = LogTable(pools)
+    rows = header["rows"]
+    for name, typecode in COLUMNS.items():
+        column = section(header["columns"][name], rows * ITEMSIZES[name], typecode)
+        setattr(table, name, column)
+    table.postings = {name: Postings() for name in INDEXED_COLUMNS}
+    for name, lists in header["postings"].items():
+        postings = table.postings[name]
+        for value, offset, count in lists:
+            postings[value] = section(offset, count * ROW_ITEMSIZE, "I")
+    table.rejected = header["rejected"]
+    return table
+
+
+def save_columns(filepath: str, identity: FileIdentity, table: LogTable, end: int = None):
+    """Write a table parsed from the first `end` bytes (default: all) of a
+    log file to its column cache, replacing any older one"""
+    if not enabled:
+        return
+    path = sidecar_path(filepath, COLUMN_CACHE_SUFFIX)
+    with metrics.stage("columns.save") as stage:
+        # Pool values are stored one per line; a value that can't be is
+        # only possible in a table filled from something other than a file
+        pools = {}
+        for name, pool in table.pools.items():
+            values = [v if isinstance(v, bytes) else v.encode("utf-8") for v in pool.values]
+            blob = b"\n".join(values)
+            if blob.count(b"\n") != max(len(values) - 1, 0):
+                return
+            pools[name] = (len(values), blob)
+
+        sections, layout = _layout(table, pools)
+        header = _expected(identity, identity.size if end is None else end)
+        header.update(layout, rows=len(table), rejected=table.rejected)
+        head = MAGIC + json.dumps(header).encode("ascii") + b"\n"
+        head += bytes(_aligned(len(head)) - len(head))
+
+        # A unique temporary name, as several processes may save at once
+        temp_path = None
+        try:
+            descriptor, temp_path = tempfile.mkstemp(
+                prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or "."
+            )
+            # mkstemp creates owner-only files; be as readable as the log
+            os.chmod(temp_path, os.stat(filepath).st_mode & 0o666)
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(head)
+                position = 0
+                for offset, data in sections:
+                    f.write(bytes(offset - position))
+                    f.write(data)
+                    position = offset + memoryview(data).nbytes
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not save column cache to '{path}': {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        stage.lines = len(table)
+        stage.bytes = len(head) + position
+
+
+def _layout(table: LogTable, pools: Dict[str, Tuple[int, bytes]]) -> Tuple[List, Dict]:
+    """(offset, data) of every section after the header, and the header
+    fields locating them"""
+    sections = []
+    position = 0
+
+    def place(data) -> int:
+        nonlocal position
+        offset = _aligned(position)
+        sections.append((offset, data))
+        position = offset + memoryview(data).nbytes
+        return offset
+
+    columns = {name: place(getattr(table, name)) for name in COLUMNS}
+    postings = {
+        name: [[value, place(rows), len(rows)] for value, rows in postings.items()]
+        for name, postings in table.postings.items()
+    }
+    pool_layout = {
+        name: [count, place(blob), len(blob)] for name, (count, blob) in pools.items()
+    }
+    layout = {
+        "columns": columns,
+        "postings": postings,
+        "pools": pool_layout,
+        "length": position,
+    }
+    return sections, layout
+
+
+enabled = os.environ.get("LOG_COLUMN_CACHE", "1") != "0"
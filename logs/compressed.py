@@ -0,0 +1,185 @@
+# Transparent reading of gzip/bz2/xz compressed and rotated log files
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+from logs import formats
+from logs.formats import LogFormat
+from logs.loader import file_format, parse_buffer
+from logs.parallel import RANGES_PER_WORKER
+from logs.table import LogTable
+
+# access.log, access.log.1, access.log.2.gz, access.log.3.bz2, ...
+LOG_FILE_PATTERN = re.compile(r"\.log(\.\d+)?(\.(gz|bz2|xz))?$")
+
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Compressed bytes buffered per read from disk, and decompressed bytes
+# parsed per chunk
+READ_BUFFER_BYTES = 1024 * 1024
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Compressed bytes per parallel gzip task
+MEMBER_RANGE_BYTES = 8 * 1024 * 1024
+
+# Start of a gzip member: magic, deflate, no reserved flag bits set
+_GZIP_HEADER = re.compile(b"\x1f\x8b\x08[\x00-\x1f]")
+
+
+def is_log_file(filename: str) -> bool:
+    return LOG_FILE_PATTERN.search(filename) is not None
+
+
+def is_compressed(filepath: str) -> bool:
+    return os.path.splitext(filepath)[1].lower() in OPENERS
+
+
+def open_log(raw: BinaryIO, filepath: str) -> BinaryIO:
+    """Binary reader over `raw` that decompresses it if `filepath` says so"""
+    opener = OPENERS.get(os.path.splitext(filepath)[1].lower())
+    if opener is None:
+        return raw
+    return opener(raw, "rb")
+
+
+def _parse_chunks(
+    file: BinaryIO, table: LogTable, log_format: LogFormat, source: BinaryIO = None, progress=None
+) -> LogTable:
+    """Parse a decompressing reader in large chunks cut at line breaks.
+
+    Progress is reported as the position reached in the compressed `source`.
+    """
+    carry = b""
+    while True:
+        chunk = file.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        chunk = carry + chunk
+        cut = chunk.rfind(b"\n") + 1
+        parse_buffer(chunk, 0, cut, table, log_format=log_format)
+        carry = chunk[cut:]
+        if progress:
+            progress(source.tell(), len(table))
+    if carry:
+        parse_buffer(carry, 0, len(carry), table, log_format=log_format)
+    return table
+
+
+def load_compressed(
+    filepath: str, workers: int = 1, progress: Callable[[int, int], None] = None
+) -> LogTable:
+    """load_logs() for a compressed file, decompressed while it is parsed.
+
+    Multi-member gzip files (concatenated or block-compressed) are
+    decompressed member by member in a process pool when `workers` > 1;
+    anything else is read sequentially.
+    """
+    log_format = file_format(filepath)
+    if workers > 1 and filepath.lower().endswith(".gz"):
+        table = _load_gzip_members_parallel(filepath, workers, log_format, progress)
+        if table is not None:
+            return table
+
+    with open(filepath, "rb", buffering=READ_BUFFER_BYTES) as raw:
+        with open_log(raw, filepath) as file:
+            return _parse_chunks(file, LogTable(), log_format, raw, progress)
+
+
+def plan_member_ranges(filepath: str, workers: int) -> List[Tuple[int, int]]:
+    """Byte ranges that start at gzip header candidates, about one per task.
+
+    A candidate may be a false match inside compressed data; the worker
+    decoding it then fails and the caller falls back to a sequential read.
+    """
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return [(0, 0)]
+    parts = max(workers * RANGES_PER_WORKER, -(-size // MEMBER_RANGE_BYTES))
+    step = max(-(-size // parts), 1)
+    bounds = [0]
+    with open(filepath, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for target in range(step, size, step):
+                if target <= bounds[-1]:
+                    continue
+                match = _GZIP_HEADER.search(data, target)
+                if match is None:
+                    break
+                bounds.append(match.start())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def parse_gzip_members(filepath: str, start: int, end: int, format_name: str):
+    """Worker: decompress whole gzip members in [start, end) and parse the
+    lines in the file's format (a LogFormat name).
+
+    Returns (head, table, tail, complete) where head and tail are the partial
+    lines before the first and after the last line break, for the caller to
+    join with the neighbouring ranges, or None if [start, end) is not a
+    sequence of complete members.
+    """
+    with open(filepath, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    parts = []
+    try:
+        while data:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            parts.append(decompressor.decompress(data))
+            if not decompressor.eof:
+                return None
+            data = decompressor.unused_data
+    except zlib.error:
+        return None
+
+    text = b"".join(parts)
+    first = text.find(b"\n")
+    if first == -1:
+        return text, None, b"", False
+    last = text.rfind(b"\n")
+    table = parse_buffer(text, first + 1, last, log_format=formats.get_format(format_name))
+    return text[:first], table, text[last + 1 :], True
+
+
+def _load_gzip_members_parallel(
+    filepath: str, workers: int, log_format: LogFormat, progress=None
+) -> Optional[LogTable]:
+    ranges = plan_member_ranges(filepath, workers)
+    if len(ranges) < 2:
+        return None  # A single member can only be inflated from its start
+
+    table = LogTable()
+    carry = b""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(parse_gzip_members, filepath, start, end, log_format.name)
+            for start, end in ranges
+        ]
+        for future, (_, range_end) in zip(futures, ranges):
+            result = future.result()
+            if result is None:
+                for other in futures:
+                    other.cancel()
+                return None
+            head, chunk, tail, complete = result
+            if not complete:
+                carry += head
+                continue
+            # The line split between this range and the previous one
+            line = carry + head
+            parse_buffer(line, 0, len(line), table, log_format=log_format)
+            table.extend(chunk)
+            carry = tail
+            if progress:
+                progress(range_end, len(table))
+    if carry:
+        parse_buffer(carry, 0, len(carry), table, log_format=log_format)
+    return table
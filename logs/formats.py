@@ -0,0 +1,352 @@
+# Access log formats: Apache LogFormat / Nginx log_format strings compiled to parsers
+import os
+import re
+from functools import lru_cache
+from itertools import islice
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# What a parser returns for a line: undecoded (ip, datetime, method, url,
+# status, size, referrer, user_agent), the argument order of
+# LogTable.append_bytes()
+FIELDS = ("ip", "datetime", "method", "url", "status", "size", "referrer", "user_agent")
+Fields = Tuple[bytes, bytes, bytes, bytes, bytes, bytes, bytes, bytes]
+
+# Built-in formats, in the order auto-detection prefers them on a tie
+NAMED_FORMATS = {
+    "combined": '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-Agent}i"',
+    "common": '%h %l %u %t "%r" %>s %b',
+    # Nginx's default "main" format, which adds the X-Forwarded-For header
+    "nginx_main": '$remote_addr - $remote_user [$time_local] "$request" '
+    '$status $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for"',
+    "nginx_timed": '$remote_addr - $remote_user [$time_local] "$request" '
+    '$status $body_bytes_sent "$http_referer" "$http_user_agent" $request_time',
+}
+DEFAULT_FORMAT = "combined"
+
+# Lines looked at by detect_format()
+DETECT_LINES = 20
+
+# Directive -> field it fills. Anything else (%l, %u, %D, $remote_user,
+# $request_time, ...) is matched but not kept.
+APACHE_DIRECTIVES = {
+    "%h": "ip",
+    "%a": "ip",
+    "%{c}a": "ip",
+    "%t": "datetime",
+    "%r": "request",
+    "%>s": "status",
+    "%s": "status",
+    "%b": "size",
+    "%B": "size",
+    "%{referer}i": "referrer",
+    "%{user-agent}i": "user_agent",
+}
+NGINX_VARIABLES = {
+    "remote_addr": "ip",
+    "time_local": "datetime",
+    "request": "request",
+    "status": "status",
+    "body_bytes_sent": "size",
+    "bytes_sent": "size",
+    "http_referer": "referrer",
+    "http_user_agent": "user_agent",
+}
+REQUIRED_FIELDS = ("ip", "datetime", "request", "status")
+
+_APACHE_DIRECTIVE = re.compile(r"%[<>]?(?:!?\d+(?:,\d+)*)?(?:\{[^}]*\})?[a-zA-Z%]")
+_NGINX_VARIABLE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+
+# Field regexes for the fallback parser
+_QUOTED = r'[^"\\]*(?:\\.[^"\\]*)*'
+_FIELD_PATTERNS = {
+    "ip": r"[0-9A-Fa-f:.]+",
+    "datetime": r"[^\]]+",
+    "status": r"\d{3}",
+    "size": r"\d+|-",
+}
+
+# What the regex allows after a format's last field: more unquoted fields,
+# as the split parser does (e.g. a $request_time appended to a format), but
+# nothing quoted, so a combined line is not read as common with its
+# referrer and user agent dropped
+_LINE_END = r'(?:\s+[^"\s]\S*)*\s*\Z'
+
+# Shape of the formats the split parser handles: the Common Log Format
+# (with any ident/user directives or "-"), then quoted fields, then
+# unquoted ones. "{}" stands for a directive.
+_SPLIT_SHAPE = re.compile(
+    r'\{\} (\{\}|-) (\{\}|-) \[\{\}\] "\{\}" \{\} \{\}((?: "\{\}")*)((?: \{\})*)'
+)
+
+
+def tokenize(spec: str) -> List[Tuple[str, Optional[str]]]:
+    """A format string as (literal text, None) and (directive, field) pairs.
+
+    Nginx formats are recognised by their $variables; the field of an
+    unknown directive is "". Apache's %t is split into "[", the time and
+    "]" so both syntaxes come out alike.
+    """
+    tokens = []
+    position = 0
+    nginx = _NGINX_VARIABLE.search(spec) is not None
+    for match in (_NGINX_VARIABLE if nginx else _APACHE_DIRECTIVE).finditer(spec):
+        if match.start() > position:
+            tokens.append((spec[position : match.start()], None))
+        position = match.end()
+        directive = match.group(0)
+        if nginx:
+            field = NGINX_VARIABLES.get(match.group(1) or match.group(2), "")
+        elif directive == "%%":
+            tokens.append(("%", None))
+            continue
+        else:
+            # Strip status conditions such as %400,501{User-agent}i
+            plain = re.sub(r"^%([<>]?)!?\d+(?:,\d+)*", r"%\1", directive)
+            field = APACHE_DIRECTIVES.get(plain) or APACHE_DIRECTIVES.get(plain.lower(), "")
+        if directive == "%t":
+            tokens.extend((("[", None), (directive, field), ("]", None)))
+        else:
+            tokens.append((directive, field))
+    if position < len(spec):
+        tokens.append((spec[position:], None))
+
+    # Adjacent literals (e.g. "[" after a space) are merged
+    merged = []
+    for text, field in tokens:
+        if field is None and merged and merged[-1][1] is None:
+            merged[-1] = (merged[-1][0] + text, None)
+        else:
+            merged.append((text, field))
+    return merged
+
+
+def split_request(request: bytes) -> Optional[Tuple[bytes, bytes]]:
+    """(method, url) of a request line, or None if it is not one.
+
+    "-" (no request read, e.g. a timed-out connection) gives ("-", "-"). A
+    missing protocol (HTTP/0.9) and spaces in the URL are tolerated.
+    """
+    parts = request.split(b" ")
+    if len(parts) == 3:
+        return parts[0], parts[1]
+    if request in (b"-", b""):
+        return b"-", b"-"
+    if len(parts) < 2 or not parts[0]:
+        return None
+    if len(parts) > 3 and parts[-1].startswith(b"HTTP/"):
+        return parts[0], b" ".join(parts[1:-1])
+    return parts[0], b" ".join(parts[1:])
+
+
+def _no_split_parser(line: bytes) -> None:
+    return None
+
+
+def _split_parser(quoted: List[str], trailing: int) -> Callable[[bytes], Optional[Fields]]:
+    """Parser for "<ip> <ident> <user> [<time>] "<request>" <status> <size>"
+    followed by the `quoted` fields and then `trailing` unquoted ones.
+
+    A line is cut at its double quotes and the unquoted pieces at spaces;
+    any line not cut into the expected number of pieces (an escaped quote in
+    a header, a space in the user name, ...) returns None and is left to the
+    regex.
+    """
+    parts_count = 3 + 2 * len(quoted)
+    referrer_at = 3 + 2 * quoted.index("referrer") if "referrer" in quoted else None
+    agent_at = 3 + 2 * quoted.index("user_agent") if "user_agent" in quoted else None
+    status_size = 2 if quoted else 2 + trailing
+
+    def parse(line: bytes) -> Optional[Fields]:
+        parts = line.split(b'"')
+        if len(parts) != parts_count or b'\\"' in line:
+            return None
+        head = parts[0].split(b" ")
+        if len(head) != 6 or head[5]:
+            return None
+        # Unquoted fields after the last quote may be followed by more
+        # (e.g. $upstream_response_time), as the regex would allow
+        middle = parts[2].split()
+        if quoted:
+            if len(middle) != 2 or len(parts[-1].split()) < trailing:
+                return None
+        elif len(middle) < status_size:
+            return None
+
+        # The same status and size the regex accepts
+        status, size = middle[0], middle[1]
+        if len(status) != 3 or not status.isdigit() or not (size.isdigit() or size == b"-"):
+            return None
+
+        request = parts[1].split(b" ")
+        if len(request) == 3:
+            method, url, _ = request
+        else:
+            request = split_request(parts[1])
+            if request is None:
+                return None
+            method, url = request
+        return (
+            head[0],
+            head[3][1:] + b" " + head[4][:-1],
+            method,
+            url,
+            status,
+            size,
+            b"-" if referrer_at is None else parts[referrer_at],
+            b"-" if agent_at is None else parts[agent_at],
+        )
+
+    return parse
+
+
+class LogFormat:
+    """A format string compiled to a fast split parser and a regex fallback.
+
+    parse() takes one undecoded line and returns its Fields, or None if the
+    line does not fit the format.
+    """
+
+    def __init__(self, spec: str, name: str = None):
+        self.spec = spec
+        self.name = name or spec
+        tokens = tokenize(spec)
+        fields = [field for _, field in tokens if field]
+        missing = [field for field in REQUIRED_FIELDS if field not in fields]
+        if missing:
+            raise ValueError(f"Log format {self.name!r} has no {', '.join(missing)} field")
+
+        self.regex = re.compile((self._pattern(tokens) + _LINE_END).encode("ascii"))
+        self.split = self._compile_split(tokens)
+
+    @staticmethod
+    def _pattern(tokens: List[Tuple[str, Optional[str]]]) -> str:
+        pattern = []
+        named = set()
+        for i, (text, field) in enumerate(tokens):
+            if field is None:
+                pattern.append(re.escape(text).replace(r"\ ", r"\s+"))
+                continue
+            quoted = (
+                0 < i < len(tokens) - 1
+                and tokens[i - 1][0].endswith('"')
+                and tokens[i + 1][0].startswith('"')
+            )
+            body = _QUOTED if quoted else _FIELD_PATTERNS.get(field, r"\S*")
+            if field and field not in named:
+                named.add(field)
+                pattern.append(f"(?P<{field}>{body})")
+            else:
+                pattern.append(f"(?:{body})")
+        return "".join(pattern)
+
+    @staticmethod
+    def _compile_split(tokens: List[Tuple[str, Optional[str]]]):
+        shape = "".join("{}" if field is not None else text for text, field in tokens)
+        match = _SPLIT_SHAPE.fullmatch(shape)
+        if match is None:
+            return _no_split_parser
+        fields = [field for _, field in tokens if field is not None]
+        # Ident and user may be directives or a literal "-"
+        leading = 5 + [match.group(1), match.group(2)].count("{}")
+        quoted = fields[leading : leading + match.group(3).count("{}")]
+        trailing = fields[leading + len(quoted) :]
+        # Kept fields must sit where the split parser looks for them
+        if (
+            fields[0] != "ip"
+            or fields[leading - 4 : leading] != ["datetime", "request", "status", "size"]
+            or any(field not in ("referrer", "user_agent", "") for field in quoted)
+            or any(trailing)
+        ):
+            return _no_split_parser
+        return _split_parser(quoted, len(trailing))
+
+    def parse_regex(self, line: bytes) -> Optional[Fields]:
+        match = self.regex.match(line)
+        if match is None:
+            return None
+        groups = match.groupdict()
+        request = split_request(groups["request"])
+        if request is None:
+            return None
+        size = groups.get("size")
+        referrer = groups.get("referrer")
+        user_agent = groups.get("user_agent")
+        return (
+            groups["ip"],
+            groups["datetime"],
+            request[0],
+            request[1],
+            groups["status"],
+            b"-" if size is None else size,
+            b"-" if referrer is None else referrer,
+            b"-" if user_agent is None else user_agent,
+        )
+
+    def parse(self, line: bytes) -> Optional[Fields]:
+        return self.split(line) or self.parse_regex(line)
+
+    def __repr__(self) -> str:
+        return f"LogFormat({self.name!r})"
+
+
+@lru_cache(maxsize=32)
+def get_format(spec: str) -> LogFormat:
+    """A built-in format by name, or a LogFormat/log_format string compiled"""
+    if spec in NAMED_FORMATS:
+        return LogFormat(NAMED_FORMATS[spec], spec)
+    return LogFormat(spec)
+
+
+def detect_format(lines: Iterable[bytes]) -> LogFormat:
+    """The built-in format that reads the most of the given lines.
+
+    Ties go to the format whose split parser reads more of them, then to
+    the earlier one in NAMED_FORMATS; if nothing fits, DEFAULT_FORMAT.
+    """
+    lines = [line for line in islice(lines, DETECT_LINES) if line.strip()]
+    best, best_score = get_format(DEFAULT_FORMAT), (0, 0)
+    for name in NAMED_FORMATS:
+        log_format = get_format(name)
+        split = sum(1 for line in lines if log_format.split(line))
+        parsed = sum(1 for line in lines if log_format.parse(line))
+        if (parsed, split) > best_score:
+            best, best_score = log_format, (parsed, split)
+    return best
+
+
+def sample_lines(buffer, start: int = 0, end: int = None) -> List[bytes]:
+    """The first DETECT_LINES lines of a bytes-like buffer from `start`"""
+    end = len(buffer) if end is None else end
+    lines = []
+    position = start
+    while position < end and len(lines) < DETECT_LINES:
+        line_end = buffer.find(b"\n", position, end)
+        if line_end == -1:
+            line_end = end
+        lines.append(bytes(buffer[position:line_end]))
+        position = line_end + 1
+    return lines
+
+
+def configure(spec: str = None):
+    """Parse every file with one format (a name or format string) from now
+    on, or auto-detect each file's format again when `spec` is None.
+
+    The choice is also put in the environment, so worker processes started
+    afterwards parse the same way.
+    """
+    global configured
+    configured = get_format(spec) if spec else None
+    if spec:
+        os.environ["LOG_FORMAT"] = spec
+    else:
+        os.environ.pop("LOG_FORMAT", None)
+
+
+def resolve(lines: Iterable[bytes]) -> LogFormat:
+    """The configured format, or the one detected from a file's first lines"""
+    return configured or detect_format(lines)
+
+
+_spec = os.environ.get("LOG_FORMAT")
+configured = get_format(_spec) if _spec else None
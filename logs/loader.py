@@ -1,26 +1,194 @@
 # Log reader/parser
-import re
-from typing import List, Dict
-
-LOG_PATTERN = re.compile(
-    r"(?P<ip>\d+\.\d+\.\d+\.\d+)\s-\s-\s"               # IP Address
-    r"\[(?P<datetime>[^\]]+)\]\s"                       # Date and time
-    r'"(?P<method>\w+)\s(?P<url>\S+)\sHTTP/\d\.\d"\s'   # Method + URL + HTTP version
-    r"(?P<status>\d{3})\s(?P<size>\d+|-)\s"             # Status + Size
-    r'"(?P<referrer>[^"]*)"\s"(?P<user_agent>[^"]*)"'   # Referrer + User Agent
-)
-
-def parse_log_line(line: str) -> Dict:
-    match = LOG_PATTERN.match(line)
-    if match:
-        return match.groupdict()
-    return {}
-
-def load_logs(filepath: str) -> List[Dict]:
-    parsed_logs = []
-    with open(filepath, 'r', encoding='utf-8') as file:
-        for line in file:
-            parsed = parse_log_line(line)
-            if parsed:
-                parsed_logs.append(parsed)
-    return parsed_logs
+import mmap
+import os
+from itertools import chain, islice
+from typing import Callable, Dict, Iterator
+
+from logs import column_cache, formats
+from logs.formats import DETECT_LINES, FIELDS, LogFormat
+from logs.table import LogTable, convert_fields
+from utils.cache import file_identity
+from utils.metrics import metrics
+
+# How many lines iter_logs() reads between progress callbacks
+PROGRESS_EVERY = 10_000
+
+# How many bytes parse_buffer() parses between progress callbacks
+PROGRESS_BYTES = 4 * 1024 * 1024
+
+# Bytes of a mapped file cut into lines at a time by parse_buffer()
+BLOCK_BYTES = 1024 * 1024
+
+def parse_log_line(line: str, log_format: LogFormat = None) -> Dict:
+    """Fields of one line as a dict of strings, or {} if it doesn't parse.
+
+    The format is the configured one or detected from the line itself.
+    """
+    raw = line.encode("utf-8")
+    log_format = log_format or formats.resolve([raw])
+    fields = log_format.parse(raw)
+    if fields is None:
+        return {}
+    return dict(zip(FIELDS, [value.decode("utf-8", "replace") for value in fields]))
+
+def file_format(filepath: str) -> LogFormat:
+    """The configured format, or the one detected from the first lines of a
+    (possibly compressed) file. Detected once per file and passed to every
+    parse of a part of it, which would otherwise detect from that part."""
+    if formats.configured:
+        return formats.configured
+    from logs.compressed import open_log
+
+    with open(filepath, "rb") as source:
+        with open_log(source, filepath) as file:
+            head = [line.rstrip(b"\r\n") for line in islice(file, DETECT_LINES)]
+    return formats.detect_format(head)
+
+def iter_logs(
+    filepath: str, progress: Callable[[int, int], None] = None
+) -> Iterator[Dict]:
+    """Yield parse_log_line() dicts one at a time without keeping them.
+
+    `progress`, when given, is called with (bytes read, lines read) every
+    PROGRESS_EVERY lines and once at the end of the file. Compressed files
+    (.gz, .bz2, .xz) are decompressed on the fly. The format is detected
+    from the first lines unless one is configured.
+    """
+    from logs.compressed import READ_BUFFER_BYTES, open_log
+
+    lines = 0
+    rows = 0
+    # Timed as one stage with whatever consumes the rows, since the two
+    # are interleaved
+    with metrics.stage("stream") as stage:
+        # Progress is measured in bytes of the file on disk, compressed or not
+        with open(filepath, 'rb', buffering=READ_BUFFER_BYTES) as source:
+            with open_log(source, filepath) as file:
+                try:
+                    head = list(islice(file, DETECT_LINES))
+                    log_format = formats.resolve(head)
+                    parse = log_format.parse
+                    for raw in chain(head, file):
+                        lines += 1
+                        if progress and lines % PROGRESS_EVERY == 0:
+                            progress(source.tell(), lines)
+
+                        fields = parse(raw)
+                        if fields is None:
+                            continue
+                        try:
+                            # Same lines load_logs() skips
+                            convert_fields(fields[0], fields[1], fields[4], fields[5])
+                        except (ValueError, OSError, OverflowError):
+                            continue
+                        rows += 1
+                        yield dict(
+                            zip(FIELDS, [value.decode('utf-8', 'replace') for value in fields])
+                        )
+
+                    if progress:
+                        progress(source.tell(), lines)
+                finally:
+                    stage.lines = lines
+                    stage.rejected = lines - rows
+                    stage.bytes = source.tell()
+
+def parse_buffer(
+    buffer,
+    start: int = 0,
+    end: int = None,
+    table: LogTable = None,
+    progress: Callable[[int, int], None] = None,
+    log_format: LogFormat = None,
+) -> LogTable:
+    """Parse the lines of a bytes-like buffer (e.g. an mmap) into a LogTable.
+
+    Lines are read with `log_format`, by default the configured format or
+    the one detected from the lines at `start`; callers parsing one part of
+    a file pass the file's own, from file_format(). Fields are interned as
+    bytes without decoding. `progress`, when given, is called with (offset
+    reached, rows parsed) after every PROGRESS_BYTES or so.
+    """
+    table = LogTable() if table is None else table
+    end = len(buffer) if end is None else end
+    if log_format is None:
+        log_format = formats.resolve(formats.sample_lines(buffer, start, end))
+    if progress:
+        # Parse line-aligned slices so the inner loop stays callback-free
+        position = start
+        while position < end:
+            stop = buffer.find(b"\n", min(position + PROGRESS_BYTES, end), end) + 1 or end
+            parse_buffer(buffer, position, stop, table, log_format=log_format)
+            progress(stop, len(table))
+            position = stop
+        return table
+
+    append = table.append_bytes
+    split = log_format.split
+    parse_regex = log_format.parse_regex
+    position = start
+    rejected = 0
+    while position < end:
+        # A block split into lines at once is cheaper than a find and a
+        # slice per line
+        stop = buffer.find(b"\n", min(position + BLOCK_BYTES, end), end) + 1 or end
+        lines = buffer[position:stop].split(b"\n")
+        if not lines[-1]:
+            lines.pop()  # After the block's final line break
+        for line in lines:
+            # The split parser reads nearly every line; the regex gets the rest
+            fields = split(line) or parse_regex(line)
+            if fields:
+                try:
+                    append(*fields)
+                    continue
+                except (ValueError, OSError, OverflowError):
+                    pass  # Malformed timestamp, address or number
+            rejected += 1
+        position = stop
+    table.rejected += rejected
+    return table
+
+def load_logs(
+    filepath: str, workers: int = 1, progress: Callable[[int, int], None] = None
+) -> LogTable:
+    """Parse a whole log file into a LogTable.
+
+    A file parsed before is mapped from its column cache instead, as long
+    as it has not changed since. `progress` is called with (bytes of the
+    file read, rows parsed) as the parse advances. Timings, throughput and
+    rejected lines are recorded as the "parse" stage of utils.metrics.
+    """
+    identity = file_identity(filepath)
+    table = column_cache.load_columns(filepath, identity)
+    if table is not None:
+        if progress:
+            progress(identity.size, len(table))
+        return table
+
+    with metrics.stage("parse") as stage:
+        table = _load_table(filepath, workers, progress)
+        stage.lines = len(table) + table.rejected
+        stage.rejected = table.rejected
+        stage.bytes = identity.size
+    # Not if the file changed while it was read
+    if identity.size and file_identity(filepath) == identity:
+        column_cache.save_columns(filepath, identity, table)
+    return table
+
+def _load_table(filepath: str, workers: int, progress) -> LogTable:
+    from logs.compressed import is_compressed, load_compressed
+
+    if is_compressed(filepath):
+        return load_compressed(filepath, workers, progress)
+
+    if workers > 1:
+        from logs.parallel import load_logs_parallel
+
+        return load_logs_parallel(filepath, workers, progress=progress)
+
+    with open(filepath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return LogTable()  # Empty files cannot be mapped
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return parse_buffer(buffer, progress=progress)
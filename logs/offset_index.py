@@ -0,0 +1,159 @@
+# Sparse timestamp -> byte offset index for reading only a date range of a log
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from itertools import accumulate
+from typing import Optional, Tuple
+
+from logs.compressed import is_compressed
+from logs.loader import file_format, load_logs, parse_buffer
+from logs.table import LogTable
+from logs.timestamps import parse_timestamp_bytes
+from utils.cache import FileIdentity, file_identity, sidecar_path
+
+OFFSET_INDEX_SUFFIX = "offsets.idx"
+
+# One index entry per block of about this many bytes
+BLOCK_BYTES = 64 * 1024
+
+# min/max placeholders for blocks without a single readable timestamp
+_NO_TIME_MIN = 2**62
+_NO_TIME_MAX = -(2**62)
+
+_EPOCH_DAY = date(1970, 1, 1)
+
+
+class OffsetIndex:
+    """Line-aligned block start offsets with the time span of each block.
+
+    Times are local epoch seconds (the wall clock written in each line). Each
+    block records its earliest and latest line rather than its first one, so
+    lines that are slightly out of order are never missed: a range query
+    keeps every block whose span could overlap it.
+    """
+
+    def __init__(self, offsets: array, min_times: array, max_times: array, size: int):
+        self.offsets = offsets
+        self.min_times = min_times
+        self.max_times = max_times
+        self.size = size
+        # Latest time seen up to each block / earliest from each block on;
+        # both are monotonic, so they can be binary-searched
+        self._prefix_max = list(accumulate(max_times, max))
+        self._suffix_min = list(accumulate(reversed(min_times), min))[::-1]
+
+    @classmethod
+    def build(cls, buffer, size: int, block_bytes: int = BLOCK_BYTES) -> "OffsetIndex":
+        offsets, min_times, max_times = array("q"), array("q"), array("q")
+        find = buffer.find
+        position = 0
+        while position < size:
+            block_end = min(position + block_bytes, size)
+            low, high = _NO_TIME_MIN, _NO_TIME_MAX
+            line_start = position
+            # Whole lines only: the block ends after the line crossing block_end
+            while line_start < size and (line_start < block_end or line_start == position):
+                line_end = find(b"\n", line_start, size)
+                if line_end == -1:
+                    line_end = size
+                bracket = find(b"[", line_start, line_end)
+                if bracket != -1:
+                    try:
+                        utc, offset = parse_timestamp_bytes(buffer[bracket + 1 : bracket + 27])
+                    except ValueError:
+                        pass
+                    else:
+                        local = utc + offset * 60
+                        low, high = min(low, local), max(high, local)
+                line_start = line_end + 1
+            offsets.append(position)
+            min_times.append(low)
+            max_times.append(high)
+            position = line_start
+        return cls(offsets, min_times, max_times, size)
+
+    def byte_range(self, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        """Smallest [from, to) byte span holding every line timed within [start, end]"""
+        first = bisect_left(self._prefix_max, start) if start is not None else 0
+        last = (
+            bisect_right(self._suffix_min, end) - 1
+            if end is not None
+            else len(self.offsets) - 1
+        )
+        if first > last:
+            return 0, 0
+        to = self.offsets[last + 1] if last + 1 < len(self.offsets) else self.size
+        return self.offsets[first], to
+
+    @classmethod
+    def load(cls, path: str, identity: FileIdentity) -> Optional["OffsetIndex"]:
+        try:
+            with open(path, "rb") as f:
+                header = f.readline().decode("ascii").split()
+                if header[:1] != ["v1"] or header[1:] != _identity_fields(identity):
+                    return None
+                count = int(f.readline())
+                columns = []
+                for _ in range(3):
+                    column = array("q")
+                    column.fromfile(f, count)
+                    columns.append(column)
+        except (OSError, ValueError, EOFError, IndexError):
+            return None
+        return cls(*columns, identity.size)
+
+    def save(self, path: str, identity: FileIdentity):
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(("v1 " + " ".join(_identity_fields(identity)) + "\n").encode("ascii"))
+                f.write(f"{len(self.offsets)}\n".encode("ascii"))
+                self.offsets.tofile(f)
+                self.min_times.tofile(f)
+                self.max_times.tofile(f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not save offset index to '{path}': {e}")
+
+
+def _identity_fields(identity: FileIdentity):
+    return [str(identity.inode), str(identity.size), str(identity.mtime)]
+
+
+def load_logs_between(filepath: str, start_date: date = None, end_date: date = None) -> LogTable:
+    """Parse only the lines whose local date is within [start_date, end_date].
+
+    A sparse offset index, kept next to the log and rebuilt when the file
+    changes, narrows the read to the blocks that can hold such lines.
+    Compressed files can't be read from an offset and are parsed whole.
+    """
+    start = (start_date - _EPOCH_DAY).days * 86400 if start_date else None
+    end = ((end_date - _EPOCH_DAY).days + 1) * 86400 - 1 if end_date else None
+
+    identity = file_identity(filepath)
+    if identity.size == 0:
+        return LogTable()
+
+    if is_compressed(filepath):
+        table = load_logs(filepath)
+    else:
+        index_path = sidecar_path(filepath, OFFSET_INDEX_SUFFIX)
+        with open(filepath, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                index = OffsetIndex.load(index_path, identity)
+                if index is None:
+                    index = OffsetIndex.build(buffer, identity.size)
+                    index.save(index_path, identity)
+                first, to = index.byte_range(start, end)
+                table = parse_buffer(buffer, first, to, log_format=file_format(filepath))
+
+    # The blocks read can hold neighbouring lines outside the range
+    local_times = table.local_times()
+    rows = [
+        i
+        for i, local in enumerate(local_times)
+        if (start is None or local >= start) and (end is None or local <= end)
+    ]
+    return table if len(rows) == len(table) else table.take(rows)
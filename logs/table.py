@@ -0,0 +1,370 @@
+# Columnar, array-backed storage for parsed log lines
+import socket
+import sys
+from array import array
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from logs.timestamps import format_timestamp, parse_timestamp, parse_timestamp_bytes
+
+# Column name -> array typecode. Fixed-width fields are packed directly,
+# free-text fields hold codes into a per-column StringPool.
+COLUMNS = {
+    "ip": "I",  # IPv4 address packed as uint32, or a TEXT_IP_POOL code
+    "timestamp": "q",  # Epoch seconds (UTC)
+    "tz_offset": "h",  # Minutes east of UTC, as written in the log line
+    "method": "I",
+    "url": "I",
+    "status": "H",
+    "size": "Q",  # Bytes; sizes of 4 GiB and more occur
+    "referrer": "I",
+    "user_agent": "I",
+}
+POOLED_COLUMNS = ("method", "url", "referrer", "user_agent")
+
+# Low-cardinality columns with a value -> row ids index, kept up to date as
+# rows are appended, for answering filters without scanning every row
+INDEXED_COLUMNS = ("method", "status")
+
+# Size column value for a "-" (no body) response
+MISSING_SIZE = 0xFFFFFFFFFFFFFFFF
+
+# Largest value the status column holds
+MAX_STATUS = 999
+
+# Addresses that don't pack into 32 bits (IPv6) are interned in this pool
+# and their code stored in the ip column instead. Packed IPv4 addresses
+# below TEXT_IP_LIMIT (0.0.0.0/8, never a real client) are interned too, so
+# the two kinds of value cannot collide.
+TEXT_IP_POOL = "ip_text"
+TEXT_IP_LIMIT = 1 << 24
+TEXT_IP = -1  # What pack_ip() returns for an address to intern
+
+class StringPool:
+    """Intern table: every distinct value is stored once and referenced by code.
+
+    Values are interned as they come from the parser, str or undecoded bytes,
+    and bytes are only decoded when a code is looked up for display.
+    """
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    @classmethod
+    def from_values(cls, values: list) -> "StringPool":
+        """Pool holding `values` (all distinct) under codes 0, 1, 2..."""
+        pool = cls()
+        pool.values = values
+        pool.codes = dict(zip(values, range(len(values))))
+        return pool
+
+    def intern(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: str) -> Optional[int]:
+        code = self.codes.get(value)
+        if code is None and isinstance(value, str):
+            code = self.codes.get(value.encode("utf-8"))
+        return code
+
+    def __getitem__(self, code: int) -> str:
+        value = self.values[code]
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "replace")
+        return value
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class Postings(dict):
+    """Row ids per value of one column, in ascending order"""
+
+    def __missing__(self, value) -> array:
+        rows = self[value] = array("I")
+        return rows
+
+
+# Raw address -> packed value; clients repeat a lot, so this saves most
+# inet_aton calls. Emptied when it grows past MAX_PACKED_IPS entries.
+MAX_PACKED_IPS = 1_000_000
+_packed_ips = {}
+
+
+def pack_ip(ip) -> int:
+    """Dotted IPv4 address as a uint32, or TEXT_IP for a valid IPv6 one.
+
+    Raises OSError (or ValueError) for anything else.
+    """
+    packed = _packed_ips.get(ip)
+    if packed is None:
+        text = ip.decode("ascii") if isinstance(ip, bytes) else ip
+        if ":" in text:
+            socket.inet_pton(socket.AF_INET6, text)
+            packed = TEXT_IP
+        elif text.count(".") != 3:
+            raise OSError(f"Not an IPv4 address: {text!r}")  # inet_aton takes "10.1"
+        else:
+            packed = int.from_bytes(socket.inet_aton(text), "big")
+            if packed < TEXT_IP_LIMIT:
+                packed = TEXT_IP
+        if len(_packed_ips) >= MAX_PACKED_IPS:
+            _packed_ips.clear()
+        _packed_ips[ip] = packed
+    return packed
+
+
+def unpack_ip(value: int) -> str:
+    return socket.inet_ntoa(value.to_bytes(4, "big"))
+
+
+def parse_status(status) -> int:
+    """Status code from its log text (str or bytes); ValueError if out of range"""
+    value = int(status)
+    if not 0 <= value <= MAX_STATUS:
+        raise ValueError(f"Status code out of range: {status!r}")
+    return value
+
+
+def parse_size(size) -> int:
+    """Response size from its log text (str or bytes), MISSING_SIZE for "-";
+    ValueError if it doesn't fit the size column"""
+    if size == "-" or size == b"-":
+        return MISSING_SIZE
+    value = int(size)
+    if not 0 <= value < MISSING_SIZE:
+        raise ValueError(f"Response size out of range: {size!r}")
+    return value
+
+
+def convert_fields(ip, dt_raw: bytes, status, size) -> Tuple[int, int, int, int, int]:
+    """(packed ip, timestamp, tz offset, status, size) of a line's undecoded
+    fields. Raises ValueError or OSError for every line append_bytes()
+    rejects, so readers that don't fill a table skip the same lines."""
+    timestamp, tz_offset = parse_timestamp_bytes(dt_raw)
+    return pack_ip(ip), timestamp, tz_offset, parse_status(status), parse_size(size)
+
+
+class LogTable:
+    """Parsed log lines stored column by column.
+
+    Each line costs a few dozen bytes instead of a dict of eight strings.
+    Iterating a table yields dict rows shaped like parse_log_line() output,
+    but the analyzer and dashboard filters work on the columns directly.
+
+    A table read from the column cache (logs.column_cache) has read-only
+    memoryviews of the mapped file as columns and posting lists; copy() it
+    before appending rows.
+    """
+
+    def __init__(self, pools: Dict[str, StringPool] = None):
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode))
+        self.pools = pools or {
+            name: StringPool() for name in POOLED_COLUMNS + (TEXT_IP_POOL,)
+        }
+        self.postings = {name: Postings() for name in INDEXED_COLUMNS}
+        # Lines the parser skipped while filling this table
+        self.rejected = 0
+
+    def append(self, ip, dt_str, method, url, status, size, referrer, user_agent):
+        """Append one line from its raw string fields.
+
+        Every field is converted before any column grows, so a line that
+        raises leaves the table as it was.
+        """
+        timestamp, tz_offset = parse_timestamp(dt_str)
+        packed = pack_ip(ip)
+        status = parse_status(status)
+        size = parse_size(size)
+        self._append(
+            packed, ip, timestamp, tz_offset, method, url, status, size, referrer, user_agent
+        )
+
+    def append_bytes(self, ip, dt_raw, method, url, status, size, referrer, user_agent):
+        """append() for undecoded fields from the bytes parser"""
+        packed, timestamp, tz_offset, status, size = convert_fields(ip, dt_raw, status, size)
+        self._append(
+            packed, ip, timestamp, tz_offset, method, url, status, size, referrer, user_agent
+        )
+
+    def _append(
+        self, packed, ip, timestamp, tz_offset, method, url, status, size, referrer, user_agent
+    ):
+        """Append one line from converted fields; only interning can fail,
+        and it comes first"""
+        ip_value = packed if packed != TEXT_IP else self._intern_ip(ip)
+        row = len(self.status)
+        self.ip.append(ip_value)
+        self.timestamp.append(timestamp)
+        self.tz_offset.append(tz_offset)
+        self.status.append(status)
+        self.size.append(size)
+        pools = self.pools
+        method = pools["method"].intern(method)
+        self.method.append(method)
+        self.url.append(pools["url"].intern(url))
+        self.referrer.append(pools["referrer"].intern(referrer))
+        self.user_agent.append(pools["user_agent"].intern(user_agent))
+        postings = self.postings
+        postings["method"][method].append(row)
+        postings["status"][status].append(row)
+
+    def _intern_ip(self, ip) -> int:
+        code = self.pools[TEXT_IP_POOL].intern(ip)
+        if code >= TEXT_IP_LIMIT:
+            raise ValueError("Too many distinct IPv6 addresses for one table")
+        return code
+
+    def _unpack_ip(self, value: int) -> str:
+        if value < TEXT_IP_LIMIT:
+            return self.pools[TEXT_IP_POOL][value]
+        return unpack_ip(value)
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def row(self, i: int) -> Dict:
+        size = self.size[i]
+        return {
+            "ip": self._unpack_ip(self.ip[i]),
+            "datetime": format_timestamp(self.timestamp[i], self.tz_offset[i]),
+            "method": self.pools["method"][self.method[i]],
+            "url": self.pools["url"][self.url[i]],
+            "status": str(self.status[i]),
+            "size": "-" if size == MISSING_SIZE else str(size),
+            "referrer": self.pools["referrer"][self.referrer[i]],
+            "user_agent": self.pools["user_agent"][self.user_agent[i]],
+        }
+
+    def decode(self, column: str, value: int) -> str:
+        """Turn one stored column value back into its log text"""
+        if column in self.pools:
+            return self.pools[column][value]
+        if column == "ip":
+            return self._unpack_ip(value)
+        return str(value)
+
+    def distinct(self, column: str) -> Iterable[int]:
+        """Distinct stored values of an indexed column, without a scan"""
+        return self.postings[column].keys()
+
+    def rows_matching(self, **wanted) -> Sequence[int]:
+        """Ascending row ids whose indexed columns hold the given stored values.
+
+        Posting lists are intersected starting from the shortest one, so the
+        work is proportional to its matches rather than to the table size.
+        """
+        if not wanted:
+            return range(len(self))
+        lists = []
+        for column, value in wanted.items():
+            rows = self.postings[column].get(value)
+            if not rows:
+                return array("I")
+            lists.append((len(rows), column, value, rows))
+        lists.sort(key=itemgetter(0))
+        rows = lists[0][3]
+        for _, column, value, _ in lists[1:]:
+            values = getattr(self, column)
+            rows = array("I", [i for i in rows if values[i] == value])
+        return rows
+
+    def _rebuild_postings(self):
+        self.postings = {name: Postings() for name in INDEXED_COLUMNS}
+        for name, postings in self.postings.items():
+            for row, value in enumerate(getattr(self, name)):
+                postings[value].append(row)
+
+    def local_times(self) -> Iterator[int]:
+        """Epoch seconds shifted to the wall-clock time written in each line"""
+        return (t + o * 60 for t, o in zip(self.timestamp, self.tz_offset))
+
+    def take(self, indices: Iterable[int]) -> "LogTable":
+        """New table with the given rows, sharing this table's intern pools"""
+        indices = indices if isinstance(indices, (array, list)) else list(indices)
+        subset = LogTable(self.pools)
+        for name, typecode in COLUMNS.items():
+            column = getattr(self, name)
+            setattr(subset, name, array(typecode, [column[i] for i in indices]))
+        subset._rebuild_postings()
+        return subset
+
+    def copy(self) -> "LogTable":
+        """Independent, appendable columns sharing the (append-only) intern
+        pools; also how a table read from the column cache is made writable"""
+        duplicate = LogTable(self.pools)
+        for name, typecode in COLUMNS.items():
+            setattr(duplicate, name, _copy_array(typecode, getattr(self, name)))
+        duplicate.postings = {
+            name: Postings((value, _copy_array("I", rows)) for value, rows in postings.items())
+            for name, postings in self.postings.items()
+        }
+        duplicate.rejected = self.rejected
+        return duplicate
+
+    def extend(self, other: "LogTable"):
+        """Append all rows of another table, re-coding its pooled columns"""
+        offset = len(self)
+        remaps = {}
+        for name in COLUMNS:
+            if name in self.pools and other.pools[name] is not self.pools[name]:
+                intern = self.pools[name].intern
+                remap = remaps[name] = [intern(value) for value in other.pools[name].values]
+                getattr(self, name).extend([remap[c] for c in getattr(other, name)])
+            elif name == "ip" and other.pools[TEXT_IP_POOL].values and (
+                other.pools[TEXT_IP_POOL] is not self.pools[TEXT_IP_POOL]
+            ):
+                intern = self._intern_ip
+                remap = [intern(value) for value in other.pools[TEXT_IP_POOL].values]
+                self.ip.extend(
+                    [remap[c] if c < TEXT_IP_LIMIT else c for c in other.ip]
+                )
+            else:
+                getattr(self, name).extend(getattr(other, name))
+
+        for name, postings in other.postings.items():
+            remap = remaps.get(name)
+            for value, rows in postings.items():
+                target = self.postings[name][remap[value] if remap else value]
+                target.extend(array("I", [row + offset for row in rows]) if offset else rows)
+        self.rejected += other.rejected
+
+    @property
+    def nbytes(self) -> int:
+        columns = sum(
+            len(getattr(self, name)) * getattr(self, name).itemsize for name in COLUMNS
+        )
+        # Each interned value is held once in the values list and once as a
+        # key of the codes dict
+        pools = sum(
+            sys.getsizeof(pool.codes) + sum(sys.getsizeof(v) for v in pool.values)
+            for pool in self.pools.values()
+        )
+        postings = sum(
+            len(rows) * rows.itemsize
+            for postings in self.postings.values()
+            for rows in postings.values()
+        )
+        return columns + pools + postings
+
+
+def _copy_array(typecode: str, values) -> array:
+    """Copy of an array or of a memoryview cast to the same typecode"""
+    copied = array(typecode)
+    copied.frombytes(memoryview(values).cast("B"))
+    return copied
@@ -0,0 +1,140 @@
+# Fast parser for access log timestamps in the "%d/%b/%Y:%H:%M:%S +zzzz" layout
+import calendar
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Tuple
+
+MONTH_NAMES = (
+    "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec",
+)
+MONTHS = {name: number for number, name in enumerate(MONTH_NAMES, start=1)}
+
+# Distinct hours seen in a file are few compared to its lines, so each
+# "01/Sep/2020:05" prefix is converted once and then looked up. The caches
+# are emptied when they grow past this many entries (decades of hours).
+MAX_CACHED = 200_000
+
+# "01/Sep/2020:05" -> (local epoch of that hour, hour key, day key)
+_hour_cache = {}
+# "+0200" -> minutes east of UTC
+_offset_cache = {}
+# (local epoch // bucket size, bucket size) -> bucket key
+_bucket_key_cache = {}
+
+_BUCKET_FORMATS = {3600: "{0}-{1:02d}-{2:02d} {3:02d}:00", 86400: "{0}-{1:02d}-{2:02d}"}
+
+
+def _convert_hour(prefix: str):
+    if len(prefix) != 14 or prefix[2] != "/" or prefix[6] != "/" or prefix[11] != ":":
+        raise ValueError(f"Unrecognised log timestamp: {prefix!r}")
+    try:
+        month = MONTHS[prefix[3:6]]
+    except KeyError:
+        raise ValueError(f"Unrecognised month in log timestamp: {prefix!r}") from None
+    day, year, hour = int(prefix[0:2]), int(prefix[7:11]), int(prefix[12:14])
+    if not 1 <= day <= calendar.monthrange(year, month)[1] or hour > 23:
+        raise ValueError(f"Log timestamp out of range: {prefix!r}")
+
+    if len(_hour_cache) >= MAX_CACHED:
+        _hour_cache.clear()
+    entry = _hour_cache[prefix] = (
+        calendar.timegm((year, month, day, hour, 0, 0)),
+        f"{year}-{month:02d}-{day:02d} {hour:02d}:00",
+        f"{year}-{month:02d}-{day:02d}",
+    )
+    return entry
+
+
+def _convert_offset(text: str) -> int:
+    if len(text) != 5 or text[0] not in "+-" or not text[1:].isdigit():
+        raise ValueError(f"Unrecognised timezone offset: {text!r}")
+    minutes = int(text[1:3]) * 60 + int(text[3:5])
+    offset = _offset_cache[text] = -minutes if text[0] == "-" else minutes
+    return offset
+
+
+def parse_timestamp(dt_str: str) -> Tuple[int, int]:
+    """'01/Sep/2020:05:04:45 +0200' -> (UTC epoch seconds, offset minutes)"""
+    if len(dt_str) != 26 or dt_str[14] != ":" or dt_str[17] != ":":
+        raise ValueError(f"Unrecognised log timestamp: {dt_str!r}")
+    hour = _hour_cache.get(dt_str[:14]) or _convert_hour(dt_str[:14])
+    minute, second = int(dt_str[15:17]), int(dt_str[18:20])
+    if minute > 59 or second > 60:
+        raise ValueError(f"Log timestamp out of range: {dt_str!r}")
+
+    offset_text = dt_str[21:26]
+    offset = _offset_cache.get(offset_text)
+    if offset is None:
+        offset = _convert_offset(offset_text)
+    return hour[0] + minute * 60 + second - offset * 60, offset
+
+
+def parse_timestamp_bytes(raw: bytes) -> Tuple[int, int]:
+    """parse_timestamp() for undecoded log bytes; caches are keyed by the raw slices"""
+    if len(raw) != 26 or raw[14] != 58 or raw[17] != 58:  # 58 == ord(":")
+        raise ValueError(f"Unrecognised log timestamp: {raw!r}")
+    prefix = raw[:14]
+    hour = _hour_cache.get(prefix)
+    if hour is None:
+        hour = _hour_cache[prefix] = _convert_hour(prefix.decode("ascii", "replace"))
+    minute, second = int(raw[15:17]), int(raw[18:20])
+    if minute > 59 or second > 60:
+        raise ValueError(f"Log timestamp out of range: {raw!r}")
+
+    offset_raw = raw[21:26]
+    offset = _offset_cache.get(offset_raw)
+    if offset is None:
+        offset = _offset_cache[offset_raw] = _convert_offset(
+            offset_raw.decode("ascii", "replace")
+        )
+    return hour[0] + minute * 60 + second - offset * 60, offset
+
+
+def parse_datetime(dt_str: str) -> datetime:
+    """Timezone-aware datetime for a log timestamp"""
+    timestamp, offset = parse_timestamp(dt_str)
+    tz = timezone(timedelta(minutes=offset))
+    return datetime.fromtimestamp(timestamp, tz)
+
+
+def hour_key(dt_str: str) -> str:
+    """'01/Sep/2020:05:04:45 +0200' -> '2020-09-01 05:00' (log local time)"""
+    return (_hour_cache.get(dt_str[:14]) or _convert_hour(dt_str[:14]))[1]
+
+
+def day_key(dt_str: str) -> str:
+    """'01/Sep/2020:05:04:45 +0200' -> '2020-09-01' (log local time)"""
+    return (_hour_cache.get(dt_str[:14]) or _convert_hour(dt_str[:14]))[2]
+
+
+def hour_number(dt_str: str) -> int:
+    """'01/Sep/2020:05:04:45 +0200' -> hours since the epoch in log local time"""
+    return (_hour_cache.get(dt_str[:14]) or _convert_hour(dt_str[:14]))[0] // 3600
+
+
+def bucket_key(bucket: int, bucket_seconds: int) -> str:
+    """Key for the hour (3600) or day (86400) bucket number of a local epoch"""
+    cache_key = (bucket, bucket_seconds)
+    key = _bucket_key_cache.get(cache_key)
+    if key is None:
+        t = time.gmtime(bucket * bucket_seconds)
+        key = _BUCKET_FORMATS[bucket_seconds].format(
+            t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour
+        )
+        if len(_bucket_key_cache) >= MAX_CACHED:
+            _bucket_key_cache.clear()
+        _bucket_key_cache[cache_key] = key
+    return key
+
+
+def format_timestamp(timestamp: int, tz_offset: int) -> str:
+    """Inverse of parse_timestamp, in the Apache log layout"""
+    local = time.gmtime(timestamp + tz_offset * 60)
+    sign = "-" if tz_offset < 0 else "+"
+    hours, minutes = divmod(abs(tz_offset), 60)
+    return (
+        f"{local.tm_mday:02d}/{MONTH_NAMES[local.tm_mon - 1]}/{local.tm_year}:"
+        f"{local.tm_hour:02d}:{local.tm_min:02d}:{local.tm_sec:02d} "
+        f"{sign}{hours:02d}{minutes:02d}"
+    )
@@ -1,24 +1,36 @@
 # Entry point
-import sys
+import argparse
+import cProfile
 import os
+from datetime import date
 
 # Core CLI functions
+from logs import column_cache, formats
+from logs.compressed import is_compressed, is_log_file
 from logs.loader import load_logs
+from logs.offset_index import load_logs_between
+from logs.parallel import analyze_file_parallel
 from reports.report_generator import generate_report
-from utils.analyzer import (
-    classify_user_agents,
-    get_top_ips,
-    get_top_urls,
-    get_status_distribution,
-    group_by_hour,
-    group_by_day,
-)
+from utils.analyzer import analyze_file, analyze_logs
+from utils.checkpoint import analyze_incremental
+from utils.metrics import metrics
+from utils import numpy_backend, user_agents
+from utils.multi_file import analyze_files, expand_targets
+from utils.progress import ProgressReporter
 
 # Optional Flask App
 from app import create_app
 
 
-def run_cli(log_path=None):
+def run_cli(
+    log_path=None,
+    workers=1,
+    stream=False,
+    incremental=False,
+    start_date=None,
+    end_date=None,
+    capacity=None,
+):
     # Prompt for log file path if not provided
     if not log_path:
         log_path = input("Enter the path to your .log file: ").strip()
@@ -28,42 +40,240 @@ def run_cli(log_path=None):
         print(f"❌ Error: File '{log_path}' does not exist.")
         return
 
-    if not log_path.lower().endswith(".log"):
-        print("❌ Error: Only .log files are supported.")
+    if not is_log_file(log_path.lower()):
+        print("❌ Error: Only .log files (optionally rotated, .gz/.bz2/.xz) are supported.")
         return
 
-    # Load and analyze logs
-    logs = load_logs(log_path)
+    compressed = is_compressed(log_path)
+    if compressed and incremental:
+        print("ℹ️ Compressed logs don't grow; ignoring --incremental.")
+        incremental = False
 
-    top_ips = get_top_ips(logs)
-    top_urls = get_top_urls(logs)
-    status_distribution = get_status_distribution(logs)
-    hour_counts = group_by_hour(logs)
-    day_counts = group_by_day(logs)
-    user_agent_classes = classify_user_agents(logs)
+    # Load and analyze logs, filling every report section in one pass
+    if start_date or end_date:
+        # Seek straight to the blocks that can hold the requested dates
+        logs = load_logs_between(log_path, start_date, end_date)
+        sections = analyze_logs(logs, capacity=capacity)
+    elif incremental:
+        # Resume from the checkpoint saved next to the log by the last run
+        sections, summary = analyze_incremental(log_path, capacity=capacity)
+        print(f"🔁 {summary}")
+    elif workers > 1 and not compressed:
+        # Each worker parses a slice of the file into mergeable counters
+        sections = analyze_file_parallel(log_path, workers, capacity=capacity)
+    elif stream:
+        # One pass straight from disk; memory grows with distinct keys only
+        progress = ProgressReporter(os.path.getsize(log_path))
+        sections = analyze_file(
+            log_path, progress=progress.update, capacity=capacity
+        )
+        progress.finish()
+    else:
+        # Compressed files are decompressed on the fly, by member in
+        # parallel for multi-member gzip
+        logs = load_logs(log_path, workers if compressed else 1)
+        sections = analyze_logs(logs, capacity=capacity)
 
     generate_report(
-        top_ips,
-        top_urls,
-        status_distribution,
-        hour_counts,
-        day_counts,
-        user_agent_classes,
+        **sections,
         log_filename=log_path,  # Pass the log file path
     )
 
 
+def run_analyze(targets, workers=None, capacity=None):
+    """One report across every log file in the given directories/globs"""
+    paths = expand_targets(targets)
+    if not paths:
+        print(f"❌ Error: No log files found in {', '.join(targets) or 'the arguments'}.")
+        return
+
+    # Files are analyzed in parallel; unchanged ones come from the cache
+    sections, summary = analyze_files(paths, workers, capacity=capacity)
+    print(f"📚 {summary}")
+
+    # Name the report after the directory the files share
+    common = os.path.commonpath([os.path.abspath(path) for path in paths])
+    if os.path.isfile(common):
+        common = os.path.dirname(common)
+    generate_report(**sections, log_filename=os.path.basename(common) or "logs")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Smart log file analyzer")
+    parser.add_argument(
+        "target",
+        nargs="?",
+        help="path to a .log file (rotated and .gz/.bz2/.xz files too), "
+        "'analyze' to report on many files, or 'web' to start the Flask dashboard",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        metavar="DIR|GLOB",
+        help="with 'analyze': directories, glob patterns or files to merge into one report",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="parse the log file in N processes (default: 1; "
+        "'analyze' defaults to one process per CPU)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="analyze in one constant-memory pass without loading the file",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only parse lines appended since the last --incremental run",
+    )
+    parser.add_argument(
+        "--from",
+        dest="start_date",
+        type=date.fromisoformat,
+        metavar="YYYY-MM-DD",
+        help="only analyze lines logged on or after this date",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end_date",
+        type=date.fromisoformat,
+        metavar="YYYY-MM-DD",
+        help="only analyze lines logged on or before this date",
+    )
+    parser.add_argument(
+        "--approx-top",
+        dest="capacity",
+        type=int,
+        metavar="CAPACITY",
+        help="track top IPs/URLs with fixed-size sketches of CAPACITY keys "
+        "(bounded memory, counts shown with their error bound)",
+    )
+    parser.add_argument(
+        "--log-format",
+        metavar="FORMAT",
+        help=f"log format: {', '.join(formats.NAMED_FORMATS)}, or an Apache LogFormat / "
+        "Nginx log_format string (default: detected from the first lines of each file)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=numpy_backend.BACKENDS,
+        help="how parsed columns are aggregated and filtered: pure Python (default) "
+        "or vectorized with NumPy, if installed",
+    )
+    parser.add_argument(
+        "--no-column-cache",
+        dest="column_cache",
+        action="store_false",
+        help="always parse the log instead of mapping the parsed columns saved next to it "
+        "(<log>.columns.bin), and don't save them",
+    )
+    parser.add_argument(
+        "--ua-signatures",
+        metavar="FILE",
+        help='JSON file of lower-case user agent substrings, {"bots": [...], "browsers": [...]}, '
+        "replacing the built-in signatures",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print wall time, lines/s, MB/s, rejected lines and peak memory per stage",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FILE",
+        help="also write cProfile statistics to FILE (readable with pstats or snakeviz)",
+    )
+    return parser
+
+
+def check_modes(parser, args):
+    """Reject option combinations where one would silently override another"""
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    modes = []
+    if args.stream:
+        modes.append("--stream")
+    if args.workers and args.workers > 1:
+        modes.append("--workers")
+    if args.incremental:
+        modes.append("--incremental")
+    if args.start_date or args.end_date:
+        modes.append("--from/--to")
+
+    if args.target in ("web", "analyze"):
+        ignored = [mode for mode in modes if mode != "--workers"]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} can't be used with '{args.target}'")
+    elif len(modes) > 1:
+        parser.error(f"{' and '.join(modes)} can't be combined; pick one")
+
+
+def run_profiled(args, run):
+    """Call run(), printing stage metrics and saving cProfile output as asked"""
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    try:
+        run()
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f"📈 cProfile statistics saved to `{args.cprofile}`")
+        if args.profile:
+            print("\n⏱️ Stage profile")
+            print(metrics.format_table())
+
+
 if __name__ == "__main__":
     # Usage:
-    # python main.py              → CLI with prompt
-    # python main.py logs/file.log → CLI with file argument
-    # python main.py web          → Start Flask dashboard
-
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "web":
-            app = create_app()
-            app.run(debug=True)
-        else:
-            run_cli(sys.argv[1])
+    # python main.py                          → CLI with prompt
+    # python main.py logs/file.log            → CLI with file argument
+    # python main.py logs/file.log --workers 8 → parse on 8 cores
+    # python main.py logs/file.log --stream   → constant-memory single pass
+    # python main.py logs/file.log --incremental → resume from last checkpoint
+    # python main.py logs/file.log --from 2020-09-01 --to 2020-09-07 → date range
+    # python main.py logs/file.log.2.gz       → compressed/rotated log
+    # python main.py analyze logs/            → one report for every log in a directory
+    # python main.py logs/file.log --profile  → per-stage timings and memory
+    # python main.py logs/file.log --log-format common → skip format detection
+    # python main.py logs/file.log --backend numpy → vectorized aggregation
+    # python main.py logs/file.log --no-column-cache → parse even if cached
+    # python main.py web                      → Start Flask dashboard
+
+    parser = build_parser()
+    args = parser.parse_args()
+    check_modes(parser, args)
+    if args.log_format:
+        formats.configure(args.log_format)
+    if args.backend:
+        numpy_backend.configure(args.backend)
+    if args.ua_signatures:
+        user_agents.configure(args.ua_signatures)
+    if not args.column_cache:
+        column_cache.configure(False)
+
+    if args.target == "web":
+        app = create_app({"LOG_WORKERS": args.workers or 1})
+        app.run(debug=True)
+    elif args.target == "analyze":
+        run_profiled(
+            args,
+            lambda: run_analyze(args.inputs, workers=args.workers, capacity=args.capacity),
+        )
     else:
-        run_cli()
+        run_profiled(
+            args,
+            lambda: run_cli(
+                args.target,
+                workers=args.workers or 1,
+                stream=args.stream,
+                incremental=args.incremental,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                capacity=args.capacity,
+            ),
+        )
@@ -4,11 +4,15 @@ from datetime import datetime
 import os
 from typing import Dict, List, Tuple
 
+from utils.metrics import metrics
 
-def format_section(title: str, items: List[Tuple[str, int]]) -> str:
+
+def format_section(title: str, items: List[Tuple]) -> str:
     lines = [f"### {title}"]
-    for key, value in items:
-        lines.append(f"- `{key}`: **{value}**")
+    for key, value, *error in items:
+        # Sketch-based top lists carry an error bound as a third element
+        bound = f" (±{error[0]})" if error and error[0] else ""
+        lines.append(f"- `{key}`: **{value}**{bound}")
     return "\n".join(lines)
 
 
@@ -26,6 +30,16 @@ def format_time_series(title: str, data: Dict[str, int]) -> str:
     return "\n".join(lines)
 
 
+def format_unique_visitors(data: Dict[str, Dict[str, int]]) -> str:
+    """Hourly and daily distinct-visitor estimates from HyperLogLog sketches"""
+    return "\n\n".join(
+        [
+            format_time_series("Hourly Unique Visitors (approx.)", data.get("hour", {})),
+            format_time_series("Daily Unique Visitors (approx.)", data.get("day", {})),
+        ]
+    )
+
+
 def format_user_agents(title: str, data: Dict[str, int]) -> str:
     lines = [f"### {title}"]
     top_agents = sorted(data.items(), key=lambda x: -x[1])[:5]
@@ -38,6 +52,39 @@ def format_user_agents(title: str, data: Dict[str, int]) -> str:
     return "\n".join(lines)
 
 
+def format_header(log_name: str = None, now: datetime = None) -> str:
+    timestamp = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+    log_info = f" - {log_name}" if log_name else ""
+    return f"# Log Analyzer Report{log_info}\nGenerated on: `{timestamp}`"
+
+
+def format_report_sections(
+    top_ips: List[Tuple[str, int]],
+    top_urls: List[Tuple[str, int]],
+    status_distribution: Dict[str, int],
+    hour_counts: Dict[str, int],
+    day_counts: Dict[str, int],
+    user_agent_classes: Dict[str, int],
+    unique_visitors: Dict[str, Dict[str, int]] = None,
+) -> List[str]:
+    """The report body as separate Markdown sections, in report order"""
+    sections = [
+        format_section("Top IPs", top_ips),
+        format_section("Top URLs", top_urls),
+        format_status_section(status_distribution),
+        format_time_series("Hourly Request Volume", hour_counts),
+        format_time_series("Daily Request Volume", day_counts),
+    ]
+    if unique_visitors:
+        sections.append(format_unique_visitors(unique_visitors))
+    sections += [
+        format_user_agents("Top Bots", user_agent_classes.get("bots", {})),
+        format_user_agents("Top Browsers", user_agent_classes.get("browsers", {})),
+        format_user_agents("Unknown Agents", user_agent_classes.get("unknown", {})),
+    ]
+    return sections
+
+
 def generate_report(
     top_ips: List[Tuple[str, int]],
     top_urls: List[Tuple[str, int]],
@@ -45,30 +92,29 @@ def generate_report(
     hour_counts: Dict[str, int],
     day_counts: Dict[str, int],
     user_agent_classes: Dict[str, int],
+    unique_visitors: Dict[str, Dict[str, int]] = None,
     log_filename: str = None,
     to_file: bool = True,
 ):
     now = datetime.now()
-    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
-
-    # Create header with log filename if provided
-    log_info = f" - {log_filename}" if log_filename else ""
-    header = f"# Log Analyzer Report{log_info}\nGenerated on: `{timestamp}`\n\n"
 
-    body = "\n\n".join(
-        [
-            format_section("Top IPs", top_ips),
-            format_section("Top URLs", top_urls),
-            format_status_section(status_distribution),
-            format_time_series("Hourly Request Volume", hour_counts),
-            format_time_series("Daily Request Volume", day_counts),
-            format_user_agents("Top Bots", user_agent_classes["bots"]),
-            format_user_agents("Top Browsers", user_agent_classes["browsers"]),
-            format_user_agents("Unknown Agents", user_agent_classes["unknown"]),
-        ]
-    )
+    with metrics.stage("report") as stage:
+        # Create header with log filename if provided
+        header = format_header(log_filename, now)
+        body = "\n\n".join(
+            format_report_sections(
+                top_ips,
+                top_urls,
+                status_distribution,
+                hour_counts,
+                day_counts,
+                user_agent_classes,
+                unique_visitors,
+            )
+        )
 
-    report = header + body
+        report = header + "\n\n" + body
+        stage.bytes = len(report)
 
     # Save to root-level /reports/ folder
     if to_file:
@@ -1,13 +1,29 @@
 # Log Generator Script Generates realistic Apache/Nginx access logs for testing log analysis tools.
 # Creates a large log file with varied realistic data
-import random
+import argparse
 import datetime
+import itertools
 import os
-from typing import List
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+# Lines drawn, formatted and written together
+BATCH_LINES = 10_000
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024
+
+BASE_DATE = datetime.datetime(2020, 9, 1, 0, 0, 0)
+NUM_DAYS = 30
+
+# Error pages are small whatever was requested
+ERROR_STATUSES = {404, 403, 401}
+ERROR_SIZE_RANGE = (200, 1000)
 
 
 class LogGenerator:
-    def __init__(self):
+    def __init__(self, seed: int = None):
         # Realistic IP address ranges (mix of real and private)
         self.ip_ranges = [
             "66.249.76.",  # Google crawler
@@ -92,28 +108,42 @@ class LogGenerator:
             '"https://twitter.com/"',
             '"https://facebook.com/"',
         ]
-        pass
+
+        # Each day is generated from its own generator seeded from `seed`, so
+        # the output only depends on the seed, not on how days are sharded
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.random = random.Random(self.seed)
+
+        # Line fields, precomputed once so a batch is drawn with
+        # random.choices() instead of a weighted scan per field per line
+        self._ips = [base + str(n) for base in self.ip_ranges for n in range(1, 255)]
+        self._methods, self._method_weights = self._cumulative(self.http_methods)
+        self._paths, self._path_weights = self._cumulative(self.url_paths)
+        self._statuses, self._status_weights = self._cumulative(self.status_codes)
+        self._agents = [f'"{agent}"' for agent in self.user_agents]
+        self._size_ranges = {
+            (method, path): self.response_size_range(method, path)
+            for method in self._methods
+            for path in self._paths
+        }
+        self._clock = [
+            f"{h:02d}:{m:02d}:{s:02d}" for h in range(24) for m in range(60) for s in range(60)
+        ]
+
+    @staticmethod
+    def _cumulative(choices: List[tuple]) -> Tuple[list, List[int]]:
+        """(values, cumulative weights) of a weighted choice list"""
+        values = [choice for choice, _ in choices]
+        return values, list(itertools.accumulate(weight for _, weight in choices))
 
     def generate_filename(self, base_name: str = "sample") -> str:
         """Generate filename with current timestamp"""
         timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
         return f"{base_name}_{timestamp}.log"
 
-    def get_date_range(self, num_days: int = None) -> tuple:
-        """Get appropriate date range - from start of year to today"""
-        today = datetime.datetime.now()
-
-        if num_days:
-            # If specific number of days requested, go back that many days
-            start_date = today - datetime.timedelta(days=num_days - 1)
-        else:
-            # Default: from January 1st of current year to today
-            start_date = datetime.datetime(today.year, 1, 1, 0, 0, 0)
-
-        return start_date, today
-
     def generate_daily_distribution(self, total_lines: int, num_days: int) -> List[int]:
         """Generate realistic daily request distribution with weekday/weekend patterns"""
+        rng = self.random
         base_daily = total_lines // num_days
         daily_requests = []
 
@@ -126,12 +156,12 @@ class LogGenerator:
             day_of_week = day % 7
             is_weekend = day_of_week in [5, 6]  # Saturday, Sunday
 
-            if random.random() < 0.1:  # 10% chance of spike day
-                multiplier = random.uniform(1.5, 2.0)
+            if rng.random() < 0.1:  # 10% chance of spike day
+                multiplier = rng.uniform(1.5, 2.0)
             elif is_weekend:
-                multiplier = random.uniform(0.6, 0.9)
+                multiplier = rng.uniform(0.6, 0.9)
             else:
-                multiplier = random.uniform(0.8, 1.2)
+                multiplier = rng.uniform(0.8, 1.2)
 
             daily_count = int(base_daily * multiplier)
             daily_requests.append(daily_count)
@@ -141,95 +171,111 @@ class LogGenerator:
         difference = total_lines - current_total
 
         # Distribute the difference randomly across days
-        for _ in range(abs(difference)):
-            day_idx = random.randint(0, num_days - 1)
+        for day_idx in rng.choices(range(num_days), k=abs(difference)):
             if difference > 0:
                 daily_requests[day_idx] += 1
-            else:
-                if daily_requests[day_idx] > 0:
-                    daily_requests[day_idx] -= 1
+            elif daily_requests[day_idx] > 0:
+                daily_requests[day_idx] -= 1
 
         return daily_requests
 
-    def weighted_choice(self, choices: List[tuple]) -> str:
-        """Select item based on weights"""
-        total = sum(weight for _, weight in choices)
-        r = random.uniform(0, total)
-        upto = 0
-        for choice, weight in choices:
-            if upto + weight >= r:
-                return choice
-            upto += weight
-        return choices[-1][0]
-
-    def generate_ip(self) -> str:
-        """Generate a realistic IP address"""
-        base = random.choice(self.ip_ranges)
-        return base + str(random.randint(1, 254))
-
-    def generate_timestamp(self, base_date: datetime.datetime) -> str:
-        """Generate timestamp in Apache log format"""
-        # Add random seconds to base date
-        random_seconds = random.randint(0, 86400)  # 0 to 24 hours
-        timestamp = base_date + datetime.timedelta(seconds=random_seconds)
-        return timestamp.strftime("[%d/%b/%Y:%H:%M:%S +0200]")
-
-    def generate_request_line(self) -> tuple:
-        """Generate HTTP request line and expected response size"""
-        method = self.weighted_choice(self.http_methods)
-        path = self.weighted_choice(self.url_paths)
-
-        # Determine response size based on path and method
+    def response_size_range(self, method: str, path: str) -> Tuple[int, int]:
+        """Smallest and largest response size for a request"""
         if path in ["/favicon.ico", "/robots.txt"]:
-            size = random.randint(100, 2000)
+            return 100, 2000
         elif path.endswith((".css", ".js")):
-            size = random.randint(5000, 50000)
+            return 5000, 50000
         elif path.endswith((".png", ".jpg", ".gif")):
-            size = random.randint(10000, 200000)
+            return 10000, 200000
         elif method == "POST":
-            size = random.randint(500, 5000)
-        else:
-            size = random.randint(1000, 20000)
-
-        return f'"{method} {path} HTTP/1.1"', size
-
-    def generate_log_line(self, base_date: datetime.datetime) -> str:
-        """Generate a complete log line"""
-        ip = self.generate_ip()
-        timestamp = self.generate_timestamp(base_date)
-        request_line, expected_size = self.generate_request_line()
-        status_code = self.weighted_choice(self.status_codes)
-
-        # Adjust size based on status code
-        if status_code in [404, 403, 401]:
-            size = random.randint(200, 1000)
+            return 500, 5000
+        return 1000, 20000
+
+    def generate_batch(
+        self, base_date: datetime.datetime, count: int, rng: random.Random = None
+    ) -> List[str]:
+        """`count` log lines for one day, with each field drawn for the whole
+        batch at once and timestamps assembled from cached strings"""
+        rng = rng or self.random
+        choices = rng.choices
+        uniform = rng.random
+        day = base_date.strftime("[%d/%b/%Y:")
+        next_day = (base_date + datetime.timedelta(days=1)).strftime("[%d/%b/%Y:")
+        clock = self._clock
+        size_ranges = self._size_ranges
+        error_low, error_high = ERROR_SIZE_RANGE
+
+        lines = []
+        for ip, second, method, path, status, referrer, agent in zip(
+            choices(self._ips, k=count),
+            choices(range(86401), k=count),  # 0 to 24 hours
+            choices(self._methods, cum_weights=self._method_weights, k=count),
+            choices(self._paths, cum_weights=self._path_weights, k=count),
+            choices(self._statuses, cum_weights=self._status_weights, k=count),
+            choices(self.referrers, k=count),
+            choices(self._agents, k=count),
+        ):
+            if status in ERROR_STATUSES:
+                low, high = error_low, error_high
+            else:
+                low, high = size_ranges[method, path]
+            size = low + int(uniform() * (high - low + 1))
+            if second < 86400:
+                timestamp = f"{day}{clock[second]} +0200]"
+            else:
+                timestamp = f"{next_day}00:00:00 +0200]"
+            lines.append(
+                f'{ip} - - {timestamp} "{method} {path} HTTP/1.1" {status} {size} {referrer} {agent}'
+            )
+        return lines
+
+    def write_days(self, days: List[Tuple[int, int]], output_path: str) -> int:
+        """Write (day number, line count) pairs to a file; returns lines written"""
+        line_count = 0
+        with open(output_path, "w", buffering=WRITE_BUFFER_BYTES) as f:
+            for day, requests_today in days:
+                rng = random.Random(f"{self.seed}:{day}")
+                current_date = BASE_DATE + datetime.timedelta(days=day)
+                for start in range(0, requests_today, BATCH_LINES):
+                    batch = self.generate_batch(
+                        current_date, min(BATCH_LINES, requests_today - start), rng
+                    )
+                    f.write("\n".join(batch))
+                    f.write("\n")
+                    line_count += len(batch)
+        return line_count
+
+    def generate_logs(
+        self,
+        num_lines: int,
+        base_filename: str = "sample",
+        output_path: str = None,
+        workers: int = 1,
+        num_days: int = NUM_DAYS,
+    ):
+        """Generate log file with specified number of lines.
+
+        With `workers` > 1, runs of consecutive days are written to shard
+        files by a process pool and concatenated; the output for a given
+        seed is the same either way.
+        """
+        print(f"Generating {num_lines:,} log lines (seed {self.seed})...")
+
+        if output_path:
+            full_output_path = output_path
+            output_file = os.path.basename(output_path)
         else:
-            size = expected_size
-
-        referrer = random.choice(self.referrers)
-        user_agent = f'"{random.choice(self.user_agents)}"'
-
-        return f"{ip} - - {timestamp} {request_line} {status_code} {size} {referrer} {user_agent}"
-
-    def generate_logs(self, num_lines: int, base_filename: str = "sample"):
-        """Generate log file with specified number of lines"""
-        print(f"Generating {num_lines:,} log lines...")
-
-        # Create logs directory if it doesn't exist
-        logs_dir = os.path.join("..", "logs")
-        os.makedirs(logs_dir, exist_ok=True)
+            # Create logs directory if it doesn't exist
+            logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs")
+            os.makedirs(logs_dir, exist_ok=True)
 
-        # Generate timestamped filename
-        output_file = self.generate_filename(base_filename)
-        full_output_path = os.path.join(logs_dir, output_file)
+            # Generate timestamped filename
+            output_file = self.generate_filename(base_filename)
+            full_output_path = os.path.join(logs_dir, output_file)
 
         print(f"Output file: {output_file}")
 
-        # Start from a base date and spread logs over several days
-        base_date = datetime.datetime(2020, 9, 1, 0, 0, 0)
-
         # Generate realistic daily distributions
-        num_days = 30
         daily_requests = self.generate_daily_distribution(num_lines, num_days)
 
         print(f"Distributing logs across {num_days} days...")
@@ -237,20 +283,12 @@ class LogGenerator:
             f"Daily requests range: {min(daily_requests):,} - {max(daily_requests):,}"
         )
 
-        with open(full_output_path, "w") as f:
-            line_count = 0
-            for day in range(num_days):
-                current_date = base_date + datetime.timedelta(days=day)
-                requests_today = daily_requests[day]
-
-                for _ in range(requests_today):
-                    log_line = self.generate_log_line(current_date)
-                    f.write(log_line + "\n")
-                    line_count += 1
-
-                    # Progress indicator
-                    if line_count % 10000 == 0:
-                        print(f"Generated {line_count:,} lines...")
+        days = list(enumerate(daily_requests))
+        workers = max(1, min(workers, num_days))
+        if workers == 1:
+            line_count = self.write_days(days, full_output_path)
+        else:
+            line_count = self._write_sharded(days, full_output_path, workers)
 
         # Calculate file size
         file_size = os.path.getsize(full_output_path)
@@ -261,45 +299,90 @@ class LogGenerator:
         print(f"Lines: {line_count:,}")
         print(f"Size: {size_mb:.2f} MB")
 
-
-def main():
-    generator = LogGenerator()
-    num_lines = 100000
-    base_filename = "sample"
+    def _write_sharded(
+        self, days: List[Tuple[int, int]], output_path: str, workers: int
+    ) -> int:
+        bounds = [len(days) * i // workers for i in range(workers + 1)]
+        shards = [days[start:end] for start, end in zip(bounds, bounds[1:])]
+        shard_dir = tempfile.mkdtemp(
+            prefix=".shards-", dir=os.path.dirname(os.path.abspath(output_path))
+        )
+        try:
+            shard_paths = [os.path.join(shard_dir, f"{i}.log") for i in range(len(shards))]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(self.write_days, shard, path)
+                    for shard, path in zip(shards, shard_paths)
+                ]
+                line_count = 0
+                for i, future in enumerate(futures, 1):
+                    line_count += future.result()
+                    print(f"Generated shard {i}/{len(futures)} ({line_count:,} lines)...")
+
+            with open(output_path, "wb") as out:
+                for path in shard_paths:
+                    with open(path, "rb") as shard:
+                        shutil.copyfileobj(shard, out, WRITE_BUFFER_BYTES)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        return line_count
+
+
+def positive_int(text: str) -> int:
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Generate Apache/Nginx access logs for testing the analyzer"
+    )
+    parser.add_argument(
+        "-n", "--lines", type=int, default=100000, help="Number of lines (default: 100,000)"
+    )
+    parser.add_argument(
+        "--name",
+        default="sample",
+        help="Base filename; the file is saved as logs/<name>_<timestamp>.log",
+    )
+    parser.add_argument("-o", "--output", help="Exact output path, instead of --name")
+    parser.add_argument(
+        "--seed", type=int, help="Random seed; the same seed always gives the same file"
+    )
+    parser.add_argument(
+        "--days",
+        type=positive_int,
+        default=NUM_DAYS,
+        help=f"Days to spread lines over (default: {NUM_DAYS})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes writing shards of days in parallel (default: 1)",
+    )
+    return parser
+
+
+def main(argv: List[str] = None):
+    args = build_parser().parse_args(argv)
 
     print("Apache/Nginx Log Generator")
     print("=" * 30)
 
-    # Option to customize number of lines
-    try:
-        user_input = (
-            input(f"Generate {num_lines:,} lines? (y/n) or enter number: ")
-            .strip()
-            .lower()
-        )
-        if user_input == "n":
-            return
-        elif user_input != "y" and user_input != "":
-            num_lines = int(user_input)
-    except ValueError:
-        print("Invalid input, using default...")
-
-    # Option to customize base filename
-    try:
-        filename_input = input(f"Base filename (default: '{base_filename}'): ").strip()
-        if filename_input:
-            base_filename = filename_input
-    except:
-        print("Using default filename...")
-
-    generator.generate_logs(num_lines, base_filename)
+    generator = LogGenerator(args.seed)
+    generator.generate_logs(
+        args.lines, args.name, args.output, workers=args.workers, num_days=args.days
+    )
 
     print(f"\nTo generate larger files:")
-    print(f"  Small test: 10,000 lines (~1.5 MB)")
-    print(f"  Medium: 100,000 lines (~15 MB)")
-    print(f"  Large: 1,000,000 lines (~150 MB)")
-    print(f"  Very large: 10,000,000 lines (~1.5 GB)")
-    print(f"\nFiles will be saved as: {base_filename}_YYYY_MM_DD_HH_MM_SS.log")
+    print(f"  Small test: --lines 10000 (~1.5 MB)")
+    print(f"  Medium: --lines 100000 (~15 MB)")
+    print(f"  Large: --lines 1000000 (~150 MB)")
+    print(f"  Very large: --lines 10000000 --workers 8 (~1.5 GB)")
+    print(f"Re-run with --seed {generator.seed} to reproduce this file.")
 
 
 if __name__ == "__main__":
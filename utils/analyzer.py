@@ -1,56 +1,471 @@
 # Data aggregation logic
-from collections import Counter, defaultdict
-from datetime import datetime
-from typing import List, Dict
-
-def get_top_ips(logs: List[Dict], top_n: int = 5):
-    ip_counter = Counter(log['ip'] for log in logs)
-    return ip_counter.most_common(top_n)
-
-def get_top_urls(logs: List[Dict], top_n: int = 5):
-    url_counter = Counter(log['url'] for log in logs)
-    return url_counter.most_common(top_n)
-
-def get_status_distribution(logs: List[Dict]):
-    status_counter = Counter(log['status'] for log in logs)
-    return dict(status_counter)
-
-def group_by_hour(logs):
-    hour_counts = defaultdict(int)
-    for log in logs:
-        dt = parse_datetime(log['datetime'])
-        hour_str = dt.strftime("%Y-%m-%d %H:00")
-        hour_counts[hour_str] += 1
-    return dict(hour_counts)
-
-def group_by_day(logs):
-    day_counts = defaultdict(int)
-    for log in logs:
-        dt = parse_datetime(log['datetime'])
-        day_str = dt.strftime("%Y-%m-%d")
-        day_counts[day_str] += 1
-    return dict(day_counts)
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+from logs import timestamps
+from logs.loader import iter_logs
+from logs.table import LogTable
+from utils import numpy_backend, user_agents
+from utils.metrics import metrics
+from utils.sketches import HyperLogLog, SpaceSaving, stable_hash
+
+Logs = Union[LogTable, Iterable[Dict]]
+
+# Rows of a table counted exactly before their counts are fed to a
+# Space-Saving sketch, which bounds ApproximateTopN's memory on tables too
+APPROX_BLOCK_ROWS = 65536
+
+
+def _value_counts(
+    table: LogTable, column: str, rows: Sequence[int] = None
+) -> Iterable[Tuple[int, int]]:
+    """(stored value, count) pairs of a column, or of the given ascending
+    row ids of it, in order of first occurrence"""
+    if numpy_backend.enabled:
+        values = numpy_backend.column(table, column)
+        if rows is not None:
+            values = values[numpy_backend.np.asarray(rows, dtype=numpy_backend.np.intp)]
+        return numpy_backend.value_counts(values)
+    values = getattr(table, column)
+    if rows is not None:
+        values = map(values.__getitem__, rows)
+    return Counter(values).items()
+
+
+class Accumulator:
+    """A partial aggregate that can be fed log rows and merged with its peers.
+
+    add() folds one parse_log_line()-shaped dict. add_table() folds a whole
+    LogTable and by default falls back to add() per row; subclasses override
+    it to work on the columns they need without building row dicts.
+    """
+
+    def add(self, log: Dict):
+        raise NotImplementedError
+
+    def add_table(self, table: LogTable):
+        for log in table:
+            self.add(log)
+
+    def merge(self, other: "Accumulator"):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def state(self):
+        """JSON-serializable snapshot of the partial aggregate"""
+        raise NotImplementedError
+
+    def load_state(self, state):
+        raise NotImplementedError
+
+    @property
+    def label(self) -> str:
+        """Name of this accumulator's stage in utils.metrics"""
+        return type(self).__name__
+
+
+class TopN(Accumulator):
+    """Most frequent values of one field"""
+
+    def __init__(self, field: str, top_n: int = 5):
+        self.field = field
+        self.top_n = top_n
+        self.counts = Counter()
+
+    @property
+    def label(self) -> str:
+        return f"{type(self).__name__}({self.field})"
+
+    def add(self, log: Dict):
+        self.counts[log[self.field]] += 1
+
+    def add_table(self, table: LogTable):
+        self.add_counts(table, _value_counts(table, self.field))
+
+    def add_counts(self, table: LogTable, counts: Iterable[Tuple[int, int]]):
+        """Fold (stored value, count) pairs of the table's column"""
+        decode = table.decode
+        field = self.field
+        for value, count in counts:
+            self.counts[decode(field, value)] += count
+
+    def merge(self, other: "TopN"):
+        self.counts.update(other.counts)
+
+    def result(self):
+        return self.counts.most_common(self.top_n)
+
+    def state(self):
+        return dict(self.counts)
+
+    def load_state(self, state):
+        self.counts = Counter(state)
 
-def parse_datetime(dt_str):
-    return datetime.strptime(dt_str.split(" ")[0], "%d/%b/%Y:%H:%M:%S")
 
-def classify_user_agents(logs):
-    bots = defaultdict(int)
-    browsers = defaultdict(int)
-    unknown = defaultdict(int)
+class ApproximateTopN(TopN):
+    """TopN in fixed memory, backed by a Space-Saving sketch of `capacity` keys.
 
-    for log in logs:
-        user_agent = log.get("user_agent", "").lower()
+    Results are (value, count, error) triples; the true count lies within
+    [count - error, count].
+    """
 
-        if "bot" in user_agent or "spider" in user_agent or "crawler" in user_agent:
-            bots[user_agent]+=1
-        elif "mozilla" in user_agent or "chrome" in user_agent or "safari" in user_agent:
-            browsers[user_agent]+=1
+    def __init__(self, field: str, top_n: int = 5, capacity: int = 1000):
+        self.field = field
+        self.top_n = top_n
+        self.counts = SpaceSaving(capacity)
+
+    def add(self, log: Dict):
+        self.counts.add(log[self.field])
+
+    def add_table(self, table: LogTable):
+        # Rows are counted exactly a block at a time, so no counter ever holds
+        # every distinct value of the table
+        decode = table.decode
+        field = self.field
+        if numpy_backend.enabled:
+            column = numpy_backend.column(table, field)
         else:
-            unknown[user_agent]+=1
+            column = getattr(table, field)
+        for start in range(0, len(table), APPROX_BLOCK_ROWS):
+            block = column[start : start + APPROX_BLOCK_ROWS]
+            if numpy_backend.enabled:
+                counts = numpy_backend.value_counts(block)
+            else:
+                counts = Counter(block).items()
+            for value, count in counts:
+                self.counts.add(decode(field, value), count)
+
+    def merge(self, other: "ApproximateTopN"):
+        self.counts.merge(other.counts)
+
+    def state(self):
+        return self.counts.state()
+
+    def load_state(self, state):
+        self.counts = SpaceSaving.from_state(state)
+
+
+class Distribution(TopN):
+    """Count of every value of one field"""
+
+    def __init__(self, field: str):
+        super().__init__(field, top_n=None)
+
+    def result(self):
+        return dict(self.counts)
+
+
+class TimeBuckets(Accumulator):
+    """Request counts per hour or per day, in the log's own local time"""
+
+    GRANULARITIES = {
+        "hour": (3600, timestamps.hour_key),
+        "day": (86400, timestamps.day_key),
+    }
+
+    def __init__(self, granularity: str = "hour"):
+        self.granularity = granularity
+        self.bucket_seconds, self.key_of = self.GRANULARITIES[granularity]
+        self.counts = Counter()
+
+    @property
+    def label(self) -> str:
+        return f"TimeBuckets({self.granularity})"
+
+    def add(self, log: Dict):
+        self.counts[self.key_of(log['datetime'])] += 1
+
+    def add_table(self, table: LogTable):
+        seconds = self.bucket_seconds
+        if numpy_backend.enabled:
+            buckets = numpy_backend.value_counts(numpy_backend.local_times(table) // seconds)
+        else:
+            buckets = Counter(t // seconds for t in table.local_times()).items()
+        for bucket, count in buckets:
+            self.counts[timestamps.bucket_key(bucket, seconds)] += count
+
+    def merge(self, other: "TimeBuckets"):
+        self.counts.update(other.counts)
+
+    def result(self):
+        return dict(self.counts)
+
+    def state(self):
+        return dict(self.counts)
+
+    def load_state(self, state):
+        self.counts = Counter(state)
+
+
+class UniqueVisitors(Accumulator):
+    """Approximate distinct visitors per hour and per day, in log local time.
+
+    A visitor is a client IP, or an IP and user agent pair with
+    fields=("ip", "user_agent"). Each hour keeps one HyperLogLog sketch of a
+    few KB; days are counted by merging their hours' sketches.
+    """
+
+    def __init__(self, fields: Tuple[str, ...] = ("ip",), precision: int = 12):
+        self.fields = fields
+        self.precision = precision
+        self.hours: Dict[int, HyperLogLog] = {}
+
+    def _sketch(self, hour: int) -> HyperLogLog:
+        sketch = self.hours.get(hour)
+        if sketch is None:
+            sketch = self.hours[hour] = HyperLogLog(self.precision)
+        return sketch
 
+    def add(self, log: Dict):
+        key = " ".join(log.get(field, "") for field in self.fields)
+        self._sketch(timestamps.hour_number(log["datetime"])).add(key)
+
+    def add_table(self, table: LogTable):
+        if numpy_backend.enabled:
+            position = HyperLogLog(self.precision).position
+            numpy_backend.add_visitors(
+                self._sketch,
+                table,
+                self.fields,
+                lambda key: position(stable_hash(key)),
+                1 << self.precision,
+            )
+            return
+        # Repeat visits within an hour don't change the sketch, so each
+        # distinct (hour, visitor) pair is added once. Each distinct visitor
+        # is hashed once, to the register and rank it sets.
+        fields, decode = self.fields, table.decode
+        hours = [(t + o * 60) // 3600 for t, o in zip(table.timestamp, table.tz_offset)]
+        columns = [getattr(table, field) for field in fields]
+        visitors = columns[0] if len(columns) == 1 else list(zip(*columns))
+        pairs = set(zip(hours, visitors))
+
+        position = HyperLogLog(self.precision).position
+        positions = {}
+        for visitor in set(visitors):
+            codes = visitor if len(columns) > 1 else (visitor,)
+            key = " ".join(decode(field, code) for field, code in zip(fields, codes))
+            positions[visitor] = position(stable_hash(key))
+
+        registers = {hour: self._sketch(hour).registers for hour in set(hours)}
+        for hour, visitor in pairs:
+            register, rank = positions[visitor]
+            hour_registers = registers[hour]
+            if rank > hour_registers[register]:
+                hour_registers[register] = rank
+
+    def merge(self, other: "UniqueVisitors"):
+        for hour, sketch in other.hours.items():
+            self._sketch(hour).merge(sketch)
+
+    def result(self):
+        if numpy_backend.enabled:
+            hours, days = numpy_backend.visitor_counts(self.hours)
+            return {
+                "hour": {timestamps.bucket_key(h, 3600): n for h, n in hours.items()},
+                "day": {timestamps.bucket_key(d, 86400): n for d, n in days.items()},
+            }
+        days = {}
+        for hour in sorted(self.hours):
+            day = days.get(hour // 24)
+            if day is None:
+                day = days[hour // 24] = HyperLogLog(self.precision)
+            day.merge(self.hours[hour])
+        return {
+            "hour": {
+                timestamps.bucket_key(hour, 3600): sketch.count()
+                for hour, sketch in sorted(self.hours.items())
+            },
+            "day": {
+                timestamps.bucket_key(day, 86400): sketch.count()
+                for day, sketch in days.items()
+            },
+        }
+
+    def state(self):
+        return {str(hour): sketch.state() for hour, sketch in self.hours.items()}
+
+    def load_state(self, state):
+        self.hours = {
+            int(hour): HyperLogLog.from_state(sketch) for hour, sketch in state.items()
+        }
+
+
+class UserAgentClasses(Accumulator):
+    """Lower-cased user agents split into bots, browsers and unknown"""
+
+    def __init__(self):
+        self.classes = {"bots": Counter(), "browsers": Counter(), "unknown": Counter()}
+
+    def _count(self, user_agent: str, count: int):
+        name, lowered = user_agents.classify(user_agent)
+        self.classes[name][lowered] += count
+
+    def add(self, log: Dict):
+        self._count(log.get("user_agent", ""), 1)
+
+    def add_table(self, table: LogTable):
+        self.add_counts(table, _value_counts(table, "user_agent"))
+
+    def add_counts(self, table: LogTable, counts: Iterable[Tuple[int, int]]):
+        """Fold (stored value, count) pairs of the table's user_agent column"""
+        # Classify each distinct agent once, weighted by how often it occurs
+        pool = table.pools["user_agent"]
+        for code, count in counts:
+            self._count(pool[code], count)
+
+    def merge(self, other: "UserAgentClasses"):
+        for name, counts in other.classes.items():
+            self.classes[name].update(counts)
+
+    def result(self):
+        return {name: dict(counts) for name, counts in self.classes.items()}
+
+    def state(self):
+        return self.result()
+
+    def load_state(self, state):
+        self.classes = {name: Counter(counts) for name, counts in state.items()}
+
+
+class Analyzer:
+    """Fills a list of accumulators in a single pass over the logs.
+
+    Row sources (lists of dicts, generators, a file being read) are walked
+    once with every accumulator updated per row. A LogTable is handed to each
+    accumulator's add_table(), which reads only the column it needs.
+    """
+
+    def __init__(self, accumulators: Sequence[Accumulator]):
+        self.accumulators = list(accumulators)
+
+    def consume(self, logs: Logs) -> "Analyzer":
+        if isinstance(logs, LogTable):
+            # Each accumulator is timed as its own stage
+            for accumulator in self.accumulators:
+                with metrics.stage(f"analyze.{accumulator.label}") as stage:
+                    accumulator.add_table(logs)
+                    stage.lines = len(logs)
+            return self
+
+        adders = [accumulator.add for accumulator in self.accumulators]
+        for log in logs:
+            for add in adders:
+                add(log)
+        return self
+
+    def consume_file(self, filepath: str, progress=None) -> "Analyzer":
+        """Stream a log file straight into the accumulators, in constant memory"""
+        return self.consume(iter_logs(filepath, progress))
+
+    def merge(self, other: "Analyzer") -> "Analyzer":
+        for mine, theirs in zip(self.accumulators, other.accumulators):
+            mine.merge(theirs)
+        return self
+
+    def results(self) -> List:
+        return [accumulator.result() for accumulator in self.accumulators]
+
+    def state(self) -> List:
+        return [accumulator.state() for accumulator in self.accumulators]
+
+    def load_state(self, state: List) -> "Analyzer":
+        for accumulator, accumulator_state in zip(self.accumulators, state):
+            accumulator.load_state(accumulator_state)
+        return self
+
+
+# Keyword names match the parameters of reports.report_generator.generate_report()
+REPORT_SECTIONS = (
+    "top_ips",
+    "top_urls",
+    "status_distribution",
+    "hour_counts",
+    "day_counts",
+    "user_agent_classes",
+    "unique_visitors",
+)
+
+
+def _top(field: str, top_n: int, capacity: int = None) -> TopN:
+    if capacity:
+        return ApproximateTopN(field, top_n, capacity)
+    return TopN(field, top_n)
+
+
+def report_analyzer(top_n: int = 5, capacity: int = None) -> Analyzer:
+    """Analyzer holding one accumulator per REPORT_SECTIONS entry.
+
+    With `capacity`, top IPs and URLs are tracked by fixed-size sketches
+    instead of exact counters.
+    """
+    return Analyzer(
+        [
+            _top("ip", top_n, capacity),
+            _top("url", top_n, capacity),
+            Distribution("status"),
+            TimeBuckets("hour"),
+            TimeBuckets("day"),
+            UserAgentClasses(),
+            UniqueVisitors(),
+        ]
+    )
+
+
+def analyze_logs(logs: Logs, top_n: int = 5, capacity: int = None) -> Dict:
+    """Every report section, computed in one pass"""
+    results = report_analyzer(top_n, capacity).consume(logs).results()
+    return dict(zip(REPORT_SECTIONS, results))
+
+
+def analyze_file(filepath: str, top_n: int = 5, progress=None, capacity: int = None) -> Dict:
+    """Every report section, streamed from the file without loading it"""
+    results = report_analyzer(top_n, capacity).consume_file(filepath, progress).results()
+    return dict(zip(REPORT_SECTIONS, results))
+
+
+def analyze_rows(table: LogTable, rows: Sequence[int] = None, top_n: int = 5) -> Dict:
+    """The top_ips, top_urls and user_agent_classes sections of some rows of
+    a table (default: all), counted through their row ids without copying
+    the rows out"""
+    top_ips, top_urls, agents = TopN("ip", top_n), TopN("url", top_n), UserAgentClasses()
+    with metrics.stage("analyze.rows") as stage:
+        top_ips.add_counts(table, _value_counts(table, "ip", rows))
+        top_urls.add_counts(table, _value_counts(table, "url", rows))
+        agents.add_counts(table, _value_counts(table, "user_agent", rows))
+        stage.lines = len(table) if rows is None else len(rows)
     return {
-        "bots": dict(bots),
-        "browsers": dict(browsers),
-        "unknown": dict(unknown)
+        "top_ips": top_ips.result(),
+        "top_urls": top_urls.result(),
+        "user_agent_classes": agents.result(),
     }
+
+
+def _run(accumulator: Accumulator, logs: Logs):
+    return Analyzer([accumulator]).consume(logs).results()[0]
+
+def get_top_ips(logs: Logs, top_n: int = 5, capacity: int = None):
+    return _run(_top("ip", top_n, capacity), logs)
+
+def get_top_urls(logs: Logs, top_n: int = 5, capacity: int = None):
+    return _run(_top("url", top_n, capacity), logs)
+
+def get_status_distribution(logs: Logs):
+    return _run(Distribution("status"), logs)
+
+def group_by_hour(logs: Logs):
+    return _run(TimeBuckets("hour"), logs)
+
+def group_by_day(logs: Logs):
+    return _run(TimeBuckets("day"), logs)
+
+def count_unique_visitors(logs: Logs, fields: Tuple[str, ...] = ("ip",)):
+    return _run(UniqueVisitors(fields), logs)
+
+def parse_datetime(dt_str):
+    return timestamps.parse_datetime(dt_str)
+
+def classify_user_agents(logs: Logs):
+    return _run(UserAgentClasses(), logs)
@@ -0,0 +1,148 @@
+# Process-wide cache for parsed logs and computed aggregates
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# A log file is identified by where it is and what it looks like on disk, so a
+# rotated, truncated or appended file never matches a stale cache entry.
+FileIdentity = namedtuple("FileIdentity", ["path", "inode", "size", "mtime"])
+
+
+def file_identity(path: str) -> FileIdentity:
+    st = os.stat(path)
+    return FileIdentity(os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def sidecar_path(path: str, suffix: str) -> str:
+    """Where derived data for a log file is persisted, next to the log itself"""
+    return f"{path}.{suffix}"
+
+
+def estimate_size(value, sample: int = 100) -> int:
+    """Rough in-memory footprint of a cached value, in bytes"""
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, (list, tuple)) and value:
+        head = value[:sample]
+        per_item = sum(_deep_sizeof(item) for item in head) / len(head)
+        return sys.getsizeof(value) + int(per_item * len(value))
+    return _deep_sizeof(value)
+
+
+def _deep_sizeof(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            _deep_sizeof(k) + _deep_sizeof(v) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(_deep_sizeof(item) for item in value)
+    return size
+
+
+class LogCache:
+    """LRU cache with a memory budget.
+
+    Keys are tuples; for a value derived from a log, the first element is
+    the log's FileIdentity. Storing a value for a new identity of a path drops
+    everything cached for the older identities of that path.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, size: int = None):
+        if size is None:
+            size = estimate_size(value)
+        with self._lock:
+            self._invalidate_stale(key[0])
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return value  # Too large to ever fit, serve it uncached
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def __contains__(self, key) -> bool:
+        """Whether `key` is cached, without counting a hit or miss"""
+        with self._lock:
+            return key in self._entries
+
+    def get_or_compute(self, key, compute, size: int = None):
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = self.put(key, compute(), size)
+        return value
+
+    def latest(self, path: str, kind: str, default=None):
+        """Most recently stored value of `kind` for any identity of `path`.
+
+        Used to find what was cached for a file before it changed, so new
+        data can be derived from it instead of from scratch.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in reversed(self._entries):
+                if (
+                    isinstance(key[0], FileIdentity)
+                    and key[0].path == path
+                    and key[1:2] == (kind,)
+                ):
+                    return self._entries[key][0]
+        return default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _invalidate_stale(self, identity):
+        if not isinstance(identity, FileIdentity):
+            return
+        stale = [
+            k
+            for k in self._entries
+            if isinstance(k[0], FileIdentity)
+            and k[0].path == identity.path
+            and k[0] != identity
+        ]
+        for key in stale:
+            self._bytes -= self._entries.pop(key)[1]
+
+
+log_cache = LogCache(int(os.environ.get("LOG_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
@@ -0,0 +1,198 @@
+# Incremental re-analysis of growing log files from persisted checkpoints
+import hashlib
+import json
+import mmap
+import os
+from collections import namedtuple
+from typing import Dict, Optional, Tuple
+
+from logs import column_cache
+from logs.loader import file_format, parse_buffer
+from logs.parallel import load_logs_parallel
+from logs.table import LogTable
+from utils import user_agents
+from utils.analyzer import REPORT_SECTIONS, report_analyzer
+from utils.cache import file_identity, sidecar_path
+from utils.metrics import metrics
+
+CHECKPOINT_VERSION = 2
+CHECKPOINT_SUFFIX = "checkpoint.json"
+
+# A rotated or rewritten file is told apart from a grown one by the inode
+# and by a checksum of its first bytes
+HEAD_BYTES = 4096
+
+
+class Checkpoint(namedtuple("Checkpoint", ["inode", "offset", "head_checksum"])):
+    """How far into a log file (in bytes, at a line start) analysis got"""
+
+    @classmethod
+    def capture(cls, buffer, inode: int, offset: int) -> "Checkpoint":
+        return cls(inode, offset, _head_checksum(buffer, offset))
+
+    def rebuild_reason(self, filepath: str) -> Optional[str]:
+        """Why the saved state can't be extended, or None if it can"""
+        try:
+            st = os.stat(filepath)
+        except FileNotFoundError:
+            return "log file is missing"
+        if st.st_ino != self.inode:
+            return "log file was replaced (rotated)"
+        if st.st_size < self.offset:
+            return "log file was truncated"
+        with open(filepath, "rb") as file:
+            head = file.read(min(HEAD_BYTES, self.offset))
+        if hashlib.sha1(head).hexdigest() != self.head_checksum:
+            return "log file was rewritten"
+        return None
+
+
+def _head_checksum(buffer, offset: int) -> str:
+    return hashlib.sha1(buffer[: min(HEAD_BYTES, offset)]).hexdigest()
+
+
+def _complete_end(buffer, start: int) -> int:
+    """Offset just past the last full line; a line still being written is left for later"""
+    return buffer.rfind(b"\n", start) + 1 or start
+
+
+def _map_file(filepath: str):
+    """(inode, read-only mmap) of a log file; the map is None for an empty file"""
+    with open(filepath, "rb") as file:
+        st = os.fstat(file.fileno())
+        if st.st_size == 0:
+            return st.st_ino, None
+        return st.st_ino, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_logs_checkpointed(
+    filepath: str,
+    table: LogTable = None,
+    checkpoint: Checkpoint = None,
+    workers: int = 1,
+    progress=None,
+) -> Tuple[LogTable, Checkpoint]:
+    """Parse a log file into a LogTable, resuming from a checkpoint when possible.
+
+    With a still-valid checkpoint only the bytes appended since are parsed,
+    into a copy of `table`. Otherwise the whole file is loaded, from its
+    column cache if that matches the file. `progress` is called with (file
+    offset reached, rows parsed).
+    """
+    resume = (
+        table is not None
+        and checkpoint is not None
+        and checkpoint.rebuild_reason(filepath) is None
+    )
+    inode, buffer = _map_file(filepath)
+    if buffer is None:
+        return LogTable(), Checkpoint(inode, 0, _head_checksum(b"", 0))
+
+    with buffer:
+        start = checkpoint.offset if resume else 0
+        end = _complete_end(buffer, start)
+        # A file parsed before (to the same line) is mapped from its column cache
+        identity = file_identity(filepath)
+        cacheable = not resume and identity.inode == inode and identity.size == len(buffer)
+        cached = column_cache.load_columns(filepath, identity, end) if cacheable else None
+        if cached is not None:
+            if progress:
+                progress(end, len(cached))
+            return cached, Checkpoint.capture(buffer, inode, end)
+
+        with metrics.stage("parse") as stage:
+            rows, rejected = (len(table), table.rejected) if resume else (0, 0)
+            if resume:
+                # Appended lines are read in the format of the file's head
+                table = parse_buffer(
+                    buffer, start, end, table.copy(), progress, file_format(filepath)
+                )
+            elif workers > 1:
+                table = load_logs_parallel(filepath, workers, end, progress)
+            else:
+                table = parse_buffer(buffer, 0, end, progress=progress)
+            # Only what this call parsed, not rows carried over from `table`
+            stage.rejected = table.rejected - rejected
+            stage.lines = len(table) - rows + stage.rejected
+            stage.bytes = end - start
+        if cacheable and file_identity(filepath) == identity:
+            column_cache.save_columns(filepath, identity, table, end)
+        return table, Checkpoint.capture(buffer, inode, end)
+
+
+def _read_state(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(path: str, state: Dict):
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"⚠️ Could not save checkpoint to '{path}': {e}")
+
+
+def analyze_incremental(filepath: str, top_n: int = 5, capacity: int = None) -> Tuple[Dict, str]:
+    """Every report section, parsing only what was appended since the last run.
+
+    Aggregate state and a byte-offset checkpoint are kept in a JSON sidecar
+    next to the log. Returns the sections and a one-line summary of what was
+    done.
+    """
+    state_path = sidecar_path(filepath, CHECKPOINT_SUFFIX)
+    saved = _read_state(state_path)
+    analyzer = report_analyzer(top_n, capacity)
+    start = 0
+    resumed = False
+
+    if not saved or saved.get("version") != CHECKPOINT_VERSION:
+        reason = "no checkpoint found"
+    elif saved.get("capacity") != capacity:
+        reason = "checkpoint was saved with a different --approx-top setting"
+    elif saved.get("user_agents") != user_agents.signatures_digest():
+        reason = "user agent signatures changed"
+    else:
+        checkpoint = Checkpoint(**saved["checkpoint"])
+        reason = checkpoint.rebuild_reason(filepath)
+        if reason is None:
+            analyzer.load_state(saved["analyzer"])
+            start = checkpoint.offset
+            resumed = True
+
+    inode, buffer = _map_file(filepath)
+    end = start
+    if buffer is not None:
+        with buffer:
+            end = _complete_end(buffer, start)
+            with metrics.stage("parse") as stage:
+                table = parse_buffer(buffer, start, end, log_format=file_format(filepath))
+                stage.lines = len(table) + table.rejected
+                stage.rejected = table.rejected
+                stage.bytes = end - start
+            analyzer.consume(table)
+            checkpoint = Checkpoint.capture(buffer, inode, end)
+    else:
+        checkpoint = Checkpoint(inode, 0, _head_checksum(b"", 0))
+
+    _write_state(
+        state_path,
+        {
+            "version": CHECKPOINT_VERSION,
+            "capacity": capacity,
+            "user_agents": user_agents.signatures_digest(),
+            "checkpoint": checkpoint._asdict(),
+            "analyzer": analyzer.state(),
+        },
+    )
+
+    if resumed:
+        summary = f"Resumed at byte {start:,}, parsed {end - start:,} appended bytes"
+    else:
+        summary = f"Full rebuild ({reason}), parsed {end:,} bytes"
+    return dict(zip(REPORT_SECTIONS, analyzer.results())), summary
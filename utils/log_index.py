@@ -0,0 +1,301 @@
+# Pre-aggregated sidecar index answering dashboard filters without rescanning
+import base64
+import json
+import os
+import sys
+from array import array
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from itertools import chain, repeat
+from operator import and_, rshift
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from logs import timestamps
+from logs.table import LogTable
+from utils.cache import FileIdentity, sidecar_path
+from utils.checkpoint import Checkpoint
+from utils.metrics import metrics
+from utils.sketches import HyperLogLog, stable_hash
+
+INDEX_VERSION = 4
+INDEX_SUFFIX = "index.json"
+
+_EPOCH_DAY = date(1970, 1, 1)
+
+# A cell's distinct IPs are kept as the HyperLogLog registers they set, each
+# one encoded as rank << PRECISION | register, in ascending order. Sorting a
+# union of cells and keeping the last rank seen per register merges their
+# sketches without a Python step per register.
+PRECISION = 12
+_REGISTER_MASK = (1 << PRECISION) - 1
+
+
+def _union(entry_lists: Iterable[array]) -> Dict[int, int]:
+    """register -> rank of the union of sketches given as entries"""
+    entries = sorted(chain.from_iterable(entry_lists))
+    return dict(
+        zip(map(and_, entries, repeat(_REGISTER_MASK)), map(rshift, entries, repeat(PRECISION)))
+    )
+
+
+def _entries(registers: Dict[int, int]) -> array:
+    return array("I", sorted(rank << PRECISION | register for register, rank in registers.items()))
+
+
+def _count(registers: Dict[int, int]) -> int:
+    """HyperLogLog.count() of a sketch with only these registers set"""
+    m = 1 << PRECISION
+    ranks = Counter(registers.values())
+    histogram = [m - len(registers)] + [ranks[rank] for rank in range(1, max(ranks, default=0) + 1)]
+    return HyperLogLog.estimate(m, HyperLogLog.harmonic_sum(histogram), histogram[0])
+
+
+def _encode_entries(entries: array) -> str:
+    if sys.byteorder == "big":
+        entries = array("I", entries)
+        entries.byteswap()
+    return base64.b64encode(entries.tobytes()).decode("ascii")
+
+
+def _decode_entries(text: str) -> array:
+    entries = array("I", base64.b64decode(text))
+    if sys.byteorder == "big":
+        entries.byteswap()
+    return entries
+
+
+class LogIndex:
+    """Request counts and distinct-IP sketches per (hour, method, status).
+
+    Hours and days are numbered from the Unix epoch in each line's own local
+    time, matching the report's hour and day buckets. Top lists are not
+    kept here: they are counted exactly from the parsed table.
+
+    An index remembers how many table rows it counts and the checkpoint of
+    the file they were parsed up to, so when the file grows it is extended
+    with the appended rows instead of being rebuilt.
+    """
+
+    def __init__(
+        self, identity: Dict, cells: List, rows: int = 0, checkpoint: Optional[List] = None
+    ):
+        self.identity = identity
+        # [hour, method, status, count, HyperLogLog entries of the cell's IPs]
+        self.cells = cells
+        # Table rows counted, and the Checkpoint (as a list) of the file
+        # they reach; None for files that can't grow, such as compressed ones
+        self.rows = rows
+        self.checkpoint = checkpoint
+        # (method filter, status filter) -> visitors per hour and per day
+        # over all dates; a date range only picks some of them
+        self._visitors: Dict[Tuple, Tuple[Dict[int, int], Dict[int, int]]] = {}
+
+    @classmethod
+    def build(
+        cls, table: LogTable, identity: FileIdentity, checkpoint: Checkpoint = None
+    ) -> "LogIndex":
+        return cls(identity._asdict(), []).extended(table, identity, checkpoint)
+
+    def extended(
+        self, table: LogTable, identity: FileIdentity, checkpoint: Checkpoint = None
+    ) -> "LogIndex":
+        """A new index counting this one's rows plus the rows of `table` past
+        them, e.g. a table of the same file after lines were appended"""
+        if self.rows:
+            table = table.take(range(self.rows, len(table)))
+        hours = [t // 3600 for t in table.local_times()]
+        methods, statuses = table.method, table.status
+        method_name = table.pools["method"].__getitem__
+
+        position = HyperLogLog(PRECISION).position
+        visitors = defaultdict(list)
+        ip_entries = {}
+        for hour, method, status, ip in set(zip(hours, methods, statuses, table.ip)):
+            entry = ip_entries.get(ip)
+            if entry is None:
+                register, rank = position(stable_hash(table.decode("ip", ip)))
+                entry = ip_entries[ip] = rank << PRECISION | register
+            visitors[(hour, method, status)].append(entry)
+
+        cells = {(hour, method, status): cell for hour, method, status, *cell in self.cells}
+        for (hour, method, status), count in Counter(zip(hours, methods, statuses)).items():
+            entry_lists = [visitors[(hour, method, status)]]
+            key = (hour, method_name(method), status)
+            cell = cells.get(key)
+            if cell is not None:
+                entry_lists.append(cell[1])
+                count += cell[0]
+            cells[key] = [count, _entries(_union(entry_lists))]
+
+        return LogIndex(
+            identity._asdict(),
+            [[*key, *cell] for key, cell in sorted(cells.items(), key=lambda item: item[0][0])],
+            self.rows + len(table),
+            list(checkpoint) if checkpoint else None,
+        )
+
+    def resumable(self, filepath: str) -> bool:
+        """Whether the file only had lines appended since this index was built"""
+        return (
+            self.checkpoint is not None
+            and Checkpoint(*self.checkpoint).rebuild_reason(filepath) is None
+        )
+
+    @classmethod
+    def load(cls, path: str, identity: FileIdentity = None) -> Optional["LogIndex"]:
+        """The saved index, or None if missing or built from another version
+        of the file; without `identity`, whatever version it was built from"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("version") != INDEX_VERSION or (
+            identity is not None and saved.get("identity") != identity._asdict()
+        ):
+            return None
+        cells = [[*cell, _decode_entries(entries)] for *cell, entries in saved["cells"]]
+        return cls(saved["identity"], cells, saved["rows"], saved["checkpoint"])
+
+    def save(self, path: str):
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "version": INDEX_VERSION,
+                        "identity": self.identity,
+                        "rows": self.rows,
+                        "checkpoint": self.checkpoint,
+                        "cells": [
+                            [*cell, _encode_entries(entries)] for *cell, entries in self.cells
+                        ],
+                    },
+                    f,
+                )
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not save log index to '{path}': {e}")
+
+    @property
+    def nbytes(self) -> int:
+        """Rough in-memory footprint, for the log cache's budget"""
+        size = sys.getsizeof(self.cells)
+        for cell in self.cells:
+            size += sys.getsizeof(cell) + sys.getsizeof(cell[1]) + sys.getsizeof(cell[4])
+        return size
+
+    @property
+    def total(self) -> int:
+        return sum(cell[3] for cell in self.cells)
+
+    def methods(self) -> List[str]:
+        return sorted({cell[1] for cell in self.cells})
+
+    def status_codes(self) -> List[str]:
+        return sorted({str(cell[2]) for cell in self.cells})
+
+    def _matches(self, method_filter, status_filter, first_day, last_day):
+        wanted_status = None
+        if status_filter and status_filter != "all":
+            wanted_status = int(status_filter) if status_filter.isdigit() else -1
+        any_method = not method_filter or method_filter == "all"
+
+        def matches(day, method, status):
+            return (
+                (any_method or method == method_filter)
+                and (wanted_status is None or status == wanted_status)
+                and (first_day is None or day >= first_day)
+                and (last_day is None or day <= last_day)
+            )
+
+        return matches
+
+    def query(
+        self, method_filter=None, status_filter=None, start_date=None, end_date=None
+    ) -> Dict:
+        """Counts, time buckets and unique visitors for one filter combination,
+        from index cells only"""
+        first_day = (start_date - _EPOCH_DAY).days if start_date else None
+        last_day = (end_date - _EPOCH_DAY).days if end_date else None
+        matches = self._matches(method_filter, status_filter, first_day, last_day)
+
+        hour_counts, day_counts, status_counts = Counter(), Counter(), Counter()
+        for hour, method, status, count, _ in self.cells:
+            if matches(hour // 24, method, status):
+                hour_counts[hour] += count
+                day_counts[hour // 24] += count
+                status_counts[str(status)] += count
+
+        hour_visitors, day_visitors = self._visitor_counts(method_filter, status_filter)
+        days = sorted(day_counts)
+        return {
+            "count": sum(day_counts.values()),
+            "first_day": _EPOCH_DAY + timedelta(days=days[0]) if days else None,
+            "last_day": _EPOCH_DAY + timedelta(days=days[-1]) if days else None,
+            "sections": {
+                "status_distribution": dict(status_counts),
+                "hour_counts": {
+                    timestamps.bucket_key(hour, 3600): count
+                    for hour, count in sorted(hour_counts.items())
+                },
+                "day_counts": {
+                    timestamps.bucket_key(day, 86400): count for day, count in sorted(day_counts.items())
+                },
+                "unique_visitors": {
+                    "hour": {
+                        timestamps.bucket_key(hour, 3600): hour_visitors[hour]
+                        for hour in sorted(hour_counts)
+                    },
+                    "day": {timestamps.bucket_key(day, 86400): day_visitors[day] for day in days},
+                },
+            },
+        }
+
+    def _visitor_counts(
+        self, method_filter, status_filter
+    ) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Distinct IPs per hour and per day of the cells passing the method
+        and status filters, computed once per filter pair"""
+        key = (method_filter, status_filter)
+        if key not in self._visitors:
+            matches = self._matches(method_filter, status_filter, None, None)
+            hour_entries, day_entries = defaultdict(list), defaultdict(list)
+            for hour, method, status, _, entries in self.cells:
+                if matches(hour // 24, method, status):
+                    hour_entries[hour].append(entries)
+                    day_entries[hour // 24].append(entries)
+            # Days are the union of their hours
+            self._visitors[key] = (
+                {hour: _count(_union(lists)) for hour, lists in hour_entries.items()},
+                {day: _count(_union(lists)) for day, lists in day_entries.items()},
+            )
+        return self._visitors[key]
+
+
+def load_or_build_index(
+    log_path: str, identity: FileIdentity, get_table, previous: LogIndex = None
+) -> LogIndex:
+    """The sidecar index for a log file, built and saved if stale or missing.
+
+    `get_table()` returns the file's parsed table and the Checkpoint it was
+    parsed up to (or None). An index of an earlier version of the file,
+    `previous` or else the saved one, is extended with the appended rows
+    if the file only grew since.
+    """
+    path = sidecar_path(log_path, INDEX_SUFFIX)
+    saved = LogIndex.load(path)
+    if saved is not None and saved.identity == identity._asdict():
+        return saved
+    previous = previous or saved
+
+    table, checkpoint = get_table()
+    with metrics.stage("index") as stage:
+        if previous is not None and previous.rows <= len(table) and previous.resumable(log_path):
+            index = previous.extended(table, identity, checkpoint)
+            stage.lines = len(table) - previous.rows
+        else:
+            index = LogIndex.build(table, identity, checkpoint)
+            stage.lines = len(table)
+    index.save(path)
+    return index
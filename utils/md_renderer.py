@@ -1,6 +1,36 @@
+import hashlib
+from typing import Iterable
+
 import markdown
 
-def render_markdown_report(filepath):
-    with open(filepath, "r", encoding="utf-8") as f:
-        md_content = f.read()
-    return markdown.markdown(md_content, extensions=["extra", "nl2br"])
+from utils.cache import LogCache
+from utils.metrics import metrics
+
+EXTENSIONS = ["extra", "nl2br"]
+
+# Rendered HTML of recently seen sections, keyed by a digest of their
+# Markdown; a section that reappears (e.g. under another filter) is not
+# converted again. Bounded by size, as one section can be a month of
+# hourly counts.
+MAX_CACHED_SECTION_BYTES = 16 * 1024 * 1024
+_section_cache = LogCache(MAX_CACHED_SECTION_BYTES)
+
+
+def render_markdown(text: str) -> str:
+    with metrics.stage("markdown") as stage:
+        stage.bytes = len(text)
+        return markdown.markdown(text, extensions=EXTENSIONS)
+
+
+def render_markdown_sections(sections: Iterable[str]) -> str:
+    """HTML for a report given as separate Markdown sections.
+
+    Each section is converted on its own, so a long one (e.g. a month of
+    hourly counts) never makes the converter walk the whole report, and
+    sections rendered before are reused.
+    """
+    parts = []
+    for section in sections:
+        key = (hashlib.blake2b(section.encode("utf-8"), digest_size=16).digest(),)
+        parts.append(_section_cache.get_or_compute(key, lambda: render_markdown(section)))
+    return "\n".join(parts)
@@ -0,0 +1,207 @@
+# Per-stage timings and counters, printed by --profile and served at /metrics
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Request latency histogram bucket bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = "log_analyzer"
+
+
+def peak_rss_bytes() -> int:
+    """High-water mark of this process's resident memory, or 0 if unknown"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecord:
+    """Counters of one run of a stage, filled in by the code being timed"""
+
+    __slots__ = ("lines", "bytes", "rejected")
+
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.rejected = 0
+
+
+class StageStats:
+    """Totals over every run of one stage"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.lines = 0
+        self.bytes = 0
+        self.rejected = 0
+        self.peak_rss = 0
+
+    def add(self, seconds: float, record: StageRecord, peak_rss: int):
+        self.calls += 1
+        self.seconds += seconds
+        self.lines += record.lines
+        self.bytes += record.bytes
+        self.rejected += record.rejected
+        self.peak_rss = max(self.peak_rss, peak_rss)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus sense"""
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            yield ("+Inf" if bound == float("inf") else repr(bound)), total
+
+
+class Metrics:
+    """Process-wide registry of pipeline stage totals and request latencies"""
+
+    def __init__(self):
+        self._stages = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        """Time a block of work; the block may set lines/bytes/rejected on
+        the record it is given"""
+        record = StageRecord()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            peak = peak_rss_bytes()
+            with self._lock:
+                stats = self._stages.get(name)
+                if stats is None:
+                    stats = self._stages[name] = StageStats()
+                stats.add(seconds, record, peak)
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float):
+        key = (endpoint, method, str(status))
+        with self._lock:
+            histogram = self._requests.get(key)
+            if histogram is None:
+                histogram = self._requests[key] = Histogram()
+            histogram.observe(seconds)
+
+    def stages(self) -> Dict[str, StageStats]:
+        with self._lock:
+            return dict(self._stages)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._requests.clear()
+
+    def format_table(self) -> str:
+        """Stage totals as an aligned text table for the CLI"""
+        rows = [("Stage", "Calls", "Time", "Lines/s", "MB/s", "Rejected", "Peak RSS")]
+        for name, stats in self.stages().items():
+            seconds = max(stats.seconds, 1e-9)
+            rows.append(
+                (
+                    name,
+                    f"{stats.calls:,}",
+                    f"{stats.seconds:.3f} s",
+                    f"{stats.lines / seconds:,.0f}" if stats.lines else "-",
+                    f"{stats.bytes / seconds / 2**20:,.1f}" if stats.bytes else "-",
+                    f"{stats.rejected:,}" if stats.lines else "-",
+                    f"{stats.peak_rss / 2**20:,.1f} MB" if stats.peak_rss else "-",
+                )
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return "\n".join(
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        )
+
+    def prometheus(self, extra: Dict[str, Tuple[str, str, float]] = None) -> str:
+        """Every counter and histogram in the Prometheus text exposition format.
+
+        `extra` maps more metric names to (type, help text, value), for
+        values kept elsewhere such as the log cache's.
+        """
+        stages = self.stages()
+        with self._lock:
+            requests = {key: _copy_histogram(h) for key, h in self._requests.items()}
+
+        lines = []
+        counters = [
+            ("stage_calls_total", "Runs of each pipeline stage", "calls"),
+            ("stage_seconds_total", "Wall time spent in each pipeline stage", "seconds"),
+            ("stage_lines_total", "Log lines handled by each pipeline stage", "lines"),
+            ("stage_bytes_total", "Bytes handled by each pipeline stage", "bytes"),
+            ("stage_rejected_lines_total", "Log lines the parser could not read", "rejected"),
+        ]
+        for metric, help_text, attribute in counters:
+            _header(lines, metric, help_text, "counter")
+            for name, stats in stages.items():
+                value = getattr(stats, attribute)
+                lines.append(f'{PREFIX}_{metric}{{stage="{_escape(name)}"}} {value}')
+
+        _header(lines, "peak_rss_bytes", "High-water mark of resident memory", "gauge")
+        lines.append(f"{PREFIX}_peak_rss_bytes {peak_rss_bytes()}")
+
+        for metric, (kind, help_text, value) in (extra or {}).items():
+            _header(lines, metric, help_text, kind)
+            lines.append(f"{PREFIX}_{metric} {value}")
+
+        metric = "request_duration_seconds"
+        _header(lines, metric, "HTTP request latency", "histogram")
+        for (endpoint, method, status), histogram in requests.items():
+            labels = f'endpoint="{_escape(endpoint)}",method="{method}",status="{status}"'
+            for bound, count in histogram.cumulative():
+                lines.append(f'{PREFIX}_{metric}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{PREFIX}_{metric}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{PREFIX}_{metric}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _copy_histogram(histogram: Histogram) -> Histogram:
+    copy = Histogram(histogram.bounds)
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
+
+
+def _header(lines: List[str], metric: str, help_text: str, kind: str):
+    lines.append(f"# HELP {PREFIX}_{metric} {help_text}")
+    lines.append(f"# TYPE {PREFIX}_{metric} {kind}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
@@ -0,0 +1,147 @@
+# One report across many log files, analyzed concurrently and cached per file
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from logs.compressed import is_log_file
+from logs.loader import load_logs
+from utils import user_agents
+from utils.analyzer import REPORT_SECTIONS, report_analyzer
+from utils.checkpoint import HEAD_BYTES
+from utils.metrics import metrics
+
+PARTIAL_VERSION = 1
+
+# Per-file partial aggregates are kept in this directory next to the logs.
+# Entries are named after the file's inode, size and mtime rather than its
+# path, so a log renamed by rotation (access.log.1 -> access.log.2) is still
+# found in the cache.
+PARTIALS_DIR = ".log-partials"
+
+
+def expand_targets(targets: List[str]) -> List[str]:
+    """Log files named by a list of files, directories and glob patterns"""
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            candidates = [os.path.join(target, name) for name in os.listdir(target)]
+        else:
+            candidates = glob.glob(target)
+        paths.extend(
+            path
+            for path in candidates
+            if os.path.isfile(path) and is_log_file(os.path.basename(path).lower())
+        )
+    return sorted(set(paths))
+
+
+def _head_checksum(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read(HEAD_BYTES)).hexdigest()
+
+
+def _partial_path(path: str) -> str:
+    st = os.stat(path)
+    name = f"{st.st_ino}-{st.st_size}-{st.st_mtime_ns}.json"
+    return os.path.join(os.path.dirname(path), PARTIALS_DIR, name)
+
+
+def load_partial(path: str, capacity: int = None) -> Optional[List]:
+    """Cached analyzer state for a log file, or None if missing or stale"""
+    try:
+        with open(_partial_path(path), "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        saved.get("version") != PARTIAL_VERSION
+        or saved.get("capacity") != capacity
+        or saved.get("user_agents") != user_agents.signatures_digest()
+        or saved.get("head_checksum") != _head_checksum(path)
+    ):
+        return None
+    return saved["analyzer"]
+
+
+def save_partial(path: str, state: List, capacity: int = None):
+    partial_path = _partial_path(path)
+    temp_path = f"{partial_path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": PARTIAL_VERSION,
+                    "capacity": capacity,
+                    "user_agents": user_agents.signatures_digest(),
+                    "head_checksum": _head_checksum(path),
+                    "analyzer": state,
+                },
+                f,
+            )
+        os.replace(temp_path, partial_path)
+    except OSError as e:
+        print(f"⚠️ Could not save partial results to '{partial_path}': {e}")
+
+
+def prune_partials(directory: str):
+    """Drop cached partials whose log file no longer exists in `directory`"""
+    partials_dir = os.path.join(directory, PARTIALS_DIR)
+    if not os.path.isdir(partials_dir):
+        return
+    current = {
+        os.path.basename(_partial_path(path))
+        for path in expand_targets([directory])
+    }
+    for name in os.listdir(partials_dir):
+        if name not in current:
+            try:
+                os.remove(os.path.join(partials_dir, name))
+            except OSError:
+                pass
+
+
+def analyze_one(path: str, top_n: int, capacity: int = None) -> List:
+    """Worker: the report analyzer state of a single log file"""
+    return report_analyzer(top_n, capacity).consume(load_logs(path)).state()
+
+
+def analyze_files(
+    paths: List[str], workers: int = None, top_n: int = 5, capacity: int = None
+) -> Tuple[Dict, str]:
+    """Every report section across many files, with each file analyzed in its
+    own process and the partial aggregates merged.
+
+    Files whose partial result is cached are not read again. Returns the
+    sections and a one-line summary of what was done.
+    """
+    states = {path: load_partial(path, capacity) for path in paths}
+    missing = [path for path, state in states.items() if state is None]
+
+    if missing:
+        # Files are parsed and analyzed in the workers, so both are timed together
+        with metrics.stage("files") as stage:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    path: pool.submit(analyze_one, path, top_n, capacity) for path in missing
+                }
+                for path, future in futures.items():
+                    states[path] = future.result()
+                    save_partial(path, states[path], capacity)
+            stage.bytes = sum(os.path.getsize(path) for path in missing)
+
+    for directory in {os.path.dirname(path) for path in paths}:
+        prune_partials(directory)
+
+    analyzer = report_analyzer(top_n, capacity)
+    for path in paths:
+        analyzer.merge(report_analyzer(top_n, capacity).load_state(states[path]))
+
+    summary = (
+        f"Analyzed {len(paths)} files: {len(missing)} parsed, "
+        f"{len(paths) - len(missing)} from cache"
+    )
+    return dict(zip(REPORT_SECTIONS, analyzer.results())), summary
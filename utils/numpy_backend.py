@@ -0,0 +1,209 @@
+# Optional NumPy implementations of the analyzer's and dashboard filters' column scans
+import os
+from array import array
+from typing import Dict, List, Sequence, Tuple
+
+from logs.table import COLUMNS, INDEXED_COLUMNS, LogTable, Postings
+from utils.sketches import HyperLogLog
+
+try:
+    import numpy as np
+except ImportError:  # The pure-Python backend needs nothing extra
+    np = None
+
+BACKENDS = ("python", "numpy")
+
+# Values spread over at most this many integers (or as many as there are
+# rows) are counted with bincount; wider ones are first mapped to dense
+# codes with np.unique
+DENSE_RANGE = 1 << 20
+
+# Rows per block when hour/register pairs are reduced for the sketches,
+# keeping the temporary arrays to a few tens of MB
+VISITOR_BLOCK_ROWS = 4_000_000
+
+
+def available() -> bool:
+    return np is not None
+
+
+def configure(name: str = None):
+    """Select the "python" (default) or "numpy" backend from now on.
+
+    The choice is also put in the environment, so worker processes started
+    afterwards use the same backend.
+    """
+    global enabled
+    name = name or "python"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown analyzer backend {name!r}; expected {', '.join(BACKENDS)}")
+    if name == "numpy" and np is None:
+        raise ValueError("The numpy backend needs NumPy installed (pip install numpy)")
+    enabled = name == "numpy"
+    os.environ["ANALYZER_BACKEND"] = name
+
+
+def column(table: LogTable, name: str):
+    """Zero-copy NumPy view of one of a table's columns"""
+    return np.frombuffer(getattr(table, name), dtype=COLUMNS[name])
+
+
+def local_times(table: LogTable):
+    """LogTable.local_times() as an int64 array"""
+    return column(table, "timestamp") + column(table, "tz_offset").astype(np.int64) * 60
+
+
+def value_counts(values) -> List[Tuple[int, int]]:
+    """(value, count) pairs of an integer array in order of first occurrence,
+    the same pairs in the same order as Counter(values).items()"""
+    values = np.asarray(values)
+    if not len(values):
+        return []
+    low, high = int(values.min()), int(values.max())
+    if high - low <= max(len(values), DENSE_RANGE):
+        distinct = None
+        codes = (values - low).astype(np.intp)
+    else:
+        distinct, codes = np.unique(values, return_inverse=True)
+    counts = np.bincount(codes)
+    first = np.full(len(counts), len(codes), dtype=np.intp)
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    present = np.flatnonzero(counts)
+    present = present[np.argsort(first[present], kind="stable")]
+    keys = present + low if distinct is None else distinct[present]
+    return list(zip(keys.tolist(), counts[present].tolist()))
+
+
+def visitor_ids(table: LogTable, fields: Sequence[str]) -> Tuple[list, "np.ndarray"]:
+    """(distinct visitors as tuples of stored values, visitor number per row)"""
+    if len(fields) == 1:
+        distinct, ids = np.unique(column(table, fields[0]), return_inverse=True)
+        return [(value,) for value in distinct.tolist()], ids
+    if len(fields) == 2 and all(COLUMNS[field] in ("I", "H") for field in fields):
+        # Two 32-bit values packed into one integer sort much faster than rows
+        high, low = (column(table, field).astype(np.uint64) for field in fields)
+        distinct, ids = np.unique((high << np.uint64(32)) | low, return_inverse=True)
+        return list(zip((distinct >> np.uint64(32)).tolist(), (distinct & 0xFFFFFFFF).tolist())), ids
+    stacked = np.column_stack([column(table, field).astype(np.int64) for field in fields])
+    distinct, ids = np.unique(stacked, axis=0, return_inverse=True)
+    return [tuple(row) for row in distinct.tolist()], ids.reshape(-1)
+
+
+def add_visitors(sketch_for, table: LogTable, fields: Sequence[str], position, size: int):
+    """UniqueVisitors.add_table() with the register updates vectorized.
+
+    `sketch_for(hour)` returns the HyperLogLog of an hour, and
+    `position(key)` the (register, rank) a visitor key sets in one of
+    `size` registers. Each distinct visitor is hashed once; the rows then
+    give (hour, register, rank) triples, reduced to the largest rank per
+    hour and register before the sketches are raised.
+    """
+    if not len(table):
+        return
+    visitors, ids = visitor_ids(table, fields)
+    decode = table.decode
+    positions = [
+        position(" ".join(decode(field, code) for field, code in zip(fields, visitor)))
+        for visitor in visitors
+    ]
+    registers = np.array([register for register, _ in positions], dtype=np.int64)
+    ranks = np.array([rank for _, rank in positions], dtype=np.uint8)
+    hours = local_times(table) // 3600
+
+    for start in range(0, len(table), VISITOR_BLOCK_ROWS):
+        block_ids = ids[start : start + VISITOR_BLOCK_ROWS]
+        block_hours = hours[start : start + VISITOR_BLOCK_ROWS]
+        first_hour = int(block_hours.min())
+        # One integer per (hour, register), so sorting groups them by hour
+        keys = (block_hours - first_hour) * size + registers[block_ids]
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        best = np.maximum.reduceat(ranks[block_ids][order], starts)
+        keys = keys[starts]
+        key_hours = keys // size + first_hour
+        key_registers = keys % size
+
+        bounds = np.flatnonzero(np.r_[True, key_hours[1:] != key_hours[:-1], True])
+        for low, high in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            current = np.frombuffer(sketch_for(int(key_hours[low])).registers, dtype=np.uint8)
+            chosen = key_registers[low:high]
+            current[chosen] = np.maximum(current[chosen], best[low:high])
+            del current  # Let go of the bytearray's buffer
+
+
+def _estimates(registers) -> List[int]:
+    """HyperLogLog.count() of each row of a matrix of registers, from one
+    bincount of every row's rank histogram. The sums are then taken the
+    same way as the sketch's own, so the estimates match exactly."""
+    rows, m = registers.shape
+    width = int(registers.max()) + 1 if registers.size else 1
+    offsets = registers.astype(np.int64) + np.arange(rows, dtype=np.int64)[:, None] * width
+    histograms = np.bincount(offsets.ravel(), minlength=rows * width).reshape(rows, width)
+    return [
+        HyperLogLog.estimate(m, HyperLogLog.harmonic_sum(histogram), histogram[0])
+        for histogram in histograms.tolist()
+    ]
+
+
+def visitor_counts(hours: Dict[int, HyperLogLog]) -> Tuple[Dict[int, int], Dict[int, int]]:
+    """({hour: estimate}, {day: estimate}) of UniqueVisitors.result(), with
+    every hour's registers in one matrix and days merged by reduceat"""
+    if not hours:
+        return {}, {}
+    numbers = sorted(hours)
+    registers = np.frombuffer(
+        b"".join(hours[hour].registers for hour in numbers), dtype=np.uint8
+    ).reshape(len(numbers), -1)
+    days = np.array(numbers, dtype=np.int64) // 24
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    daily = np.maximum.reduceat(registers, starts, axis=0)
+    return (
+        dict(zip(numbers, _estimates(registers))),
+        dict(zip(days[starts].tolist(), _estimates(daily))),
+    )
+
+
+def matching_rows(
+    table: LogTable, wanted: Dict[str, int], first_day: int = None, last_day: int = None
+) -> array:
+    """Ascending row ids whose columns hold the `wanted` stored values and
+    whose local day lies in [first_day, last_day], from boolean masks"""
+    mask = np.ones(len(table), dtype=bool)
+    for name, value in wanted.items():
+        mask &= column(table, name) == value
+    if first_day is not None or last_day is not None:
+        days = local_times(table) // 86400
+        if first_day is not None:
+            mask &= days >= first_day
+        if last_day is not None:
+            mask &= days <= last_day
+    return array("I", np.flatnonzero(mask).astype(np.uint32).tobytes())
+
+
+def take(table: LogTable, rows: Sequence[int]) -> LogTable:
+    """LogTable.take() by fancy indexing, with the postings rebuilt from a
+    stable sort of each indexed column"""
+    rows = np.asarray(rows, dtype=np.intp)
+    subset = LogTable(table.pools)
+    for name, typecode in COLUMNS.items():
+        values = array(typecode)
+        values.frombytes(column(table, name)[rows].tobytes())
+        setattr(subset, name, values)
+
+    subset.postings = {}
+    for name in INDEXED_COLUMNS:
+        postings = subset.postings[name] = Postings()
+        values = column(subset, name)
+        if not len(values):
+            continue
+        order = np.argsort(values, kind="stable").astype(np.uint32)
+        sorted_values = values[order]
+        bounds = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1], True])
+        for low, high in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            postings[int(sorted_values[low])] = array("I", order[low:high].tobytes())
+    return subset
+
+
+_name = os.environ.get("ANALYZER_BACKEND")
+enabled = _name == "numpy" and np is not None
@@ -0,0 +1,47 @@
+# Progress reporting for long-running log reads
+import sys
+import time
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+
+class ProgressReporter:
+    """Prints bytes read and lines per second on one self-overwriting line"""
+
+    def __init__(self, total_bytes: int = None, stream=None, interval: float = 0.5):
+        self.total_bytes = total_bytes
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last_print = 0.0
+        self.bytes_read = 0
+        self.lines = 0
+
+    def update(self, bytes_read: int, lines: int):
+        self.bytes_read = bytes_read
+        self.lines = lines
+        now = time.monotonic()
+        if now - self._last_print >= self.interval:
+            self._last_print = now
+            self._print(now)
+
+    def finish(self):
+        self._print(time.monotonic())
+        self.stream.write("\n")
+        self.stream.flush()
+
+    def _print(self, now: float):
+        elapsed = max(now - self.started, 1e-9)
+        parts = [format_bytes(self.bytes_read)]
+        if self.total_bytes:
+            parts[0] += f" / {format_bytes(self.total_bytes)}"
+            parts.insert(0, f"{100 * self.bytes_read / self.total_bytes:5.1f}%")
+        parts.append(f"{self.lines:,} lines")
+        parts.append(f"{self.lines / elapsed:,.0f} lines/s")
+        self.stream.write("\r⏳ " + "  ".join(parts) + "   ")
+        self.stream.flush()
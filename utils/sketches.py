@@ -0,0 +1,194 @@
+# Fixed-memory, mergeable sketches for very high-cardinality fields
+import base64
+import hashlib
+import heapq
+import math
+import re
+import zlib
+from typing import Dict, Hashable, List, Tuple
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitters summary holding at most `capacity` keys.
+
+    Counts are overestimates: for every tracked key, count - error <= true
+    count <= count. Any key with a true count above total / capacity is
+    guaranteed to be tracked. When full, a new key replaces the key with the
+    smallest count and inherits that count as its error.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        if capacity < 1:
+            raise ValueError("SpaceSaving capacity must be at least 1")
+        self.capacity = capacity
+        self.counts: Dict[Hashable, int] = {}
+        self.errors: Dict[Hashable, int] = {}
+        # (count, key) per tracked key; counts only grow, so an entry may be
+        # stale (too low) and is refreshed when it reaches the top
+        self._heap: List[Tuple[int, Hashable]] = []
+
+    def add(self, key, count: int = 1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (count, key))
+        else:
+            smallest_key, smallest = self._pop_min()
+            del counts[smallest_key]
+            del self.errors[smallest_key]
+            counts[key] = smallest + count
+            self.errors[key] = smallest
+            heapq.heappush(self._heap, (smallest + count, key))
+
+    def update(self, counted: Dict[Hashable, int]):
+        """Add pre-counted keys, e.g. a Counter of one chunk"""
+        for key, count in counted.items():
+            self.add(key, count)
+
+    def _pop_min(self) -> Tuple[Hashable, int]:
+        heap = self._heap
+        while True:
+            count, key = heapq.heappop(heap)
+            current = self.counts[key]
+            if current == count:
+                return key, count
+            heapq.heappush(heap, (current, key))
+
+    @property
+    def floor(self) -> int:
+        """Upper bound on the true count of any key not being tracked"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: "SpaceSaving"):
+        """Fold in another summary; the result keeps the overestimate guarantee"""
+        mine, theirs = self.floor, other.floor
+        counts, errors = {}, {}
+        for key in self.counts.keys() | other.counts.keys():
+            counts[key] = self.counts.get(key, mine) + other.counts.get(key, theirs)
+            errors[key] = self.errors.get(key, mine) + other.errors.get(key, theirs)
+        kept = heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1])
+        self.counts = dict(kept)
+        self.errors = {key: errors[key] for key in self.counts}
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def most_common(self, n: int = None) -> List[Tuple[Hashable, int, int]]:
+        """(key, count, error) for the n largest counts"""
+        items = sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+        return [(key, count, self.errors[key]) for key, count in items]
+
+    def state(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "items": [[key, self.counts[key], self.errors[key]] for key in self.counts],
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "SpaceSaving":
+        sketch = cls(state["capacity"])
+        for key, count, error in state["items"]:
+            sketch.counts[key] = count
+            sketch.errors[key] = error
+        sketch._heap = [(count, key) for key, count in sketch.counts.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+def stable_hash(key: str) -> int:
+    """64-bit hash of a string that is the same in every process and run.
+
+    Python's hash() of a str is salted per process, which would make sketches
+    built by parallel workers or saved in a checkpoint impossible to merge.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big"
+    )
+
+
+_NONZERO = re.compile(b"[^\\x00]")
+
+
+class HyperLogLog:
+    """Distinct-count estimate in 2**precision one-byte registers.
+
+    The default precision of 12 takes 4 KB and has a standard error of about
+    1.6%. Sketches of the same precision merge by taking the larger of each
+    register, so the union of any number of buckets can be counted.
+    """
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, key: str):
+        self.add_hash(stable_hash(key))
+
+    def add_hash(self, hashed: int):
+        index, rank = self.position(hashed)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def position(self, hashed: int) -> Tuple[int, int]:
+        """(register, rank) of a 64-bit hash: the register is picked by the
+        top bits, the rank is where the first 1 bit of the rest is,
+        counting from 1"""
+        width = 64 - self.precision
+        return hashed >> width, width - (hashed & ((1 << width) - 1)).bit_length() + 1
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        mine, theirs = self.registers, other.registers
+        if theirs.count(0) > len(theirs) // 2:
+            # A quiet bucket sets few registers; visit only those
+            for match in _NONZERO.finditer(theirs):
+                index = match.start()
+                if theirs[index] > mine[index]:
+                    mine[index] = theirs[index]
+        else:
+            self.registers = bytearray(map(max, mine, theirs))
+
+    def histogram(self) -> List[int]:
+        """How many registers hold each rank, from 0 up to the largest"""
+        registers = self.registers
+        return [registers.count(rank) for rank in range(max(registers) + 1)]
+
+    def count(self) -> int:
+        # One C-level count per rank instead of a Python step per register
+        histogram = self.histogram()
+        return self.estimate(len(self.registers), self.harmonic_sum(histogram), histogram[0])
+
+    @staticmethod
+    def harmonic_sum(histogram: List[int]) -> float:
+        """Sum of 2**-register over the registers counted in a histogram"""
+        return sum(math.ldexp(count, -rank) for rank, count in enumerate(histogram))
+
+    @staticmethod
+    def estimate(m: int, harmonic_sum: float, zeros: int) -> int:
+        """Distinct count from m registers, the sum of 2**-register over
+        them and how many are zero"""
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / harmonic_sum
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def state(self) -> Dict:
+        # Registers are mostly zeros for quiet buckets and compress well
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(zlib.compress(bytes(self.registers))).decode("ascii"),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "HyperLogLog":
+        sketch = cls(state["precision"])
+        sketch.registers = bytearray(zlib.decompress(base64.b64decode(state["registers"])))
+        return sketch
@@ -0,0 +1,191 @@
+# User-agent classification with one multi-pattern scan per distinct agent
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Classes in priority order: an agent matching signatures of several classes
+# gets the first one, so a crawler announcing itself as "Mozilla/5.0 (...
+# Googlebot ...)" is a bot. Agents matching nothing are "unknown".
+CLASSES = ("bots", "browsers")
+UNKNOWN = "unknown"
+
+# Lower-case substrings identifying each class. Override them with a JSON
+# file of the same shape named by the USER_AGENT_SIGNATURES environment
+# variable (or --ua-signatures / the app's USER_AGENT_SIGNATURES setting).
+DEFAULT_SIGNATURES = {
+    "bots": [
+        "bot",
+        "spider",
+        "crawl",
+        "slurp",
+        "facebookexternalhit",
+        "ia_archiver",
+        "mediapartners-google",
+        "bingpreview",
+        "headlesschrome",
+        # Command-line tools and HTTP libraries: scripted, not people
+        "curl",
+        "wget",
+        "httpie",
+        "python-requests",
+        "python-urllib",
+        "aiohttp",
+        "go-http-client",
+        "java/",
+        "okhttp",
+        "apache-httpclient",
+        "libwww-perl",
+        "node-fetch",
+        "axios",
+    ],
+    "browsers": [
+        "mozilla",
+        "chrome",
+        "safari",
+        "firefox",
+        "opera",
+        "edg/",
+        # Mobile devices and their browsers
+        "android",
+        "iphone",
+        "ipad",
+        "mobile",
+        "samsungbrowser",
+    ],
+}
+
+# Distinct agents whose class is remembered. Real logs have a few hundred to
+# a few thousand, so nearly every lookup is a hit.
+MAX_CACHED_AGENTS = 8192
+
+
+class SignatureMatcher:
+    """Aho-Corasick automaton over many substrings, each tagged with a rank.
+
+    The goto and failure links are folded into one transition table, so a
+    scan is a single dict lookup per character however many signatures
+    there are.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, int]]):
+        goto = [{}]
+        ranks = [None]
+        for pattern, rank in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    ranks.append(None)
+                state = next_state
+            ranks[state] = rank if ranks[state] is None else min(ranks[state], rank)
+
+        # Breadth-first: each state inherits its failure state's transitions
+        # and best rank, which are complete by the time it is reached
+        fail = [0] * len(goto)
+        transitions = [dict(goto[0])]
+        transitions.extend({} for _ in range(len(goto) - 1))
+        queue = list(goto[0].values())
+        for state in queue:
+            table = dict(transitions[fail[state]])
+            for char, child in goto[state].items():
+                fail[child] = transitions[fail[state]].get(char, 0)
+                table[char] = child
+                queue.append(child)
+            transitions[state] = table
+            inherited = ranks[fail[state]]
+            if inherited is not None and (ranks[state] is None or inherited < ranks[state]):
+                ranks[state] = inherited
+
+        self._transitions = transitions
+        self._ranks = ranks
+
+    def best_rank(self, text: str) -> Optional[int]:
+        """Lowest rank among the signatures found in `text`, or None"""
+        transitions = self._transitions
+        ranks = self._ranks
+        best = None
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            rank = ranks[state]
+            if rank is not None and (best is None or rank < best):
+                if rank == 0:
+                    return 0  # Nothing can outrank the first class
+                best = rank
+        return best
+
+
+class UserAgentClassifier:
+    """Sorts user agents into CLASSES or UNKNOWN by their signatures"""
+
+    def __init__(
+        self, signatures: Dict[str, List[str]] = None, cache_size: int = MAX_CACHED_AGENTS
+    ):
+        signatures = DEFAULT_SIGNATURES if signatures is None else signatures
+        unknown = set(signatures) - set(CLASSES)
+        if unknown:
+            raise ValueError(
+                f"Unknown user agent class(es) {', '.join(sorted(unknown))}; "
+                f"expected {', '.join(CLASSES)}"
+            )
+        self.signatures = {name: list(signatures.get(name, [])) for name in CLASSES}
+        self.digest = hashlib.sha1(
+            json.dumps(self.signatures, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+        self._matcher = SignatureMatcher(
+            (pattern.lower(), rank)
+            for rank, name in enumerate(CLASSES)
+            for pattern in self.signatures[name]
+        )
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, user_agent: str) -> Tuple[str, str]:
+        lowered = user_agent.lower()
+        rank = self._matcher.best_rank(lowered)
+        return (UNKNOWN if rank is None else CLASSES[rank]), lowered
+
+
+def load_signatures(path: str) -> Dict[str, List[str]]:
+    """Signature lists from a JSON file: {"bots": [...], "browsers": [...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        signatures = json.load(f)
+    if not isinstance(signatures, dict) or not all(
+        isinstance(patterns, list) and all(isinstance(p, str) for p in patterns)
+        for patterns in signatures.values()
+    ):
+        raise ValueError(f"'{path}' must map class names to lists of strings")
+    return signatures
+
+
+def configure(path: str = None):
+    """Use the signatures in a JSON file (or the defaults) from now on.
+
+    The path is also put in the environment, so worker processes started
+    afterwards classify the same way.
+    """
+    global classifier
+    classifier = UserAgentClassifier(load_signatures(path) if path else None)
+    if path:
+        os.environ["USER_AGENT_SIGNATURES"] = path
+    else:
+        os.environ.pop("USER_AGENT_SIGNATURES", None)
+
+
+def classify(user_agent: str) -> Tuple[str, str]:
+    """(class, lower-cased agent) of a user agent string"""
+    return classifier.classify(user_agent)
+
+
+def signatures_digest() -> str:
+    """Short fingerprint of the signatures in use, for saved aggregates"""
+    return classifier.digest
+
+
+_path = os.environ.get("USER_AGENT_SIGNATURES")
+classifier = UserAgentClassifier(load_signatures(_path) if _path else None)